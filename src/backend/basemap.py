@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+import shutil
+from PIL import Image
+import numpy as np
+
+from path_variables import data_folder
+
+CACHE_FOLDER = data_folder / "basemap_cache"
+SMALLEST_LEVEL = 256    # Stop halving once the image is this many pixels across
+PYRAMID_VERSION = 2     # Part of each pyramid's folder name, so pyramids built differently in the past aren't reused
+
+def file_hash(filename, chunk_size=1024 * 1024):
+    """A hash of the file's contents, so a cached pyramid is only reused for exactly the same image"""
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class BasemapPyramid:
+    """The basemap at full resolution and then halved again and again, cached as raw pixel arrays in a folder named
+        after the image's hash. The source image is only decoded the first time it's seen. After that each level is
+        memory mapped, so showing the whole map reads a small level, and zooming into part of it only reads the
+        rows of the level it needs. Images with transparency keep their alpha channel.
+        The full resolution level is as big as the decoded image, so only the current basemap's pyramid is kept."""
+
+    def __init__(self, folder):
+        self.folder = folder
+        with open(os.path.join(folder, "levels.json"), 'r') as file:
+            self.sizes = [tuple(size) for size in json.load(file)]
+        self.levels = [None] * len(self.sizes)
+
+    @classmethod
+    def load(cls, filename, cache_folder=CACHE_FOLDER):
+        """The pyramid for this image, building it first if it isn't already cached, and deleting every other
+            pyramid in the cache"""
+        name = f"{file_hash(filename)}.v{PYRAMID_VERSION}"
+        folder = os.path.join(cache_folder, name)
+        if not os.path.exists(os.path.join(folder, "levels.json")):
+            build_pyramid(filename, folder)
+        for entry in os.scandir(cache_folder):
+            if entry.name != name:
+                # Ignoring errors, since Windows can't delete a file that's still memory mapped (e.g. by an export)
+                shutil.rmtree(entry.path, ignore_errors=True)
+        return cls(folder)
+
+    @property
+    def size(self):
+        return self.sizes[0]
+
+    @property
+    def width(self):
+        return self.sizes[0][0]
+
+    @property
+    def height(self):
+        return self.sizes[0][1]
+
+    def level(self, number):
+        """The pixels of a level, as a read only (height, width, channels) array, only read from disk when it's used"""
+        if self.levels[number] is None:
+            self.levels[number] = np.load(os.path.join(self.folder, f"{number}.npy"), mmap_mode='r')
+        return self.levels[number]
+
+    def level_for(self, scale):
+        """The smallest level that still has at least as many pixels as the image shown at this scale
+            (relative to full resolution)"""
+        number = 0
+        while number + 1 < len(self.sizes) and self.sizes[number + 1][0] >= self.width * scale:
+            number += 1
+        return number
+
+    def resized(self, size):
+        """The whole basemap at this size"""
+        return self.region((0, 0, self.width, self.height), size)
+
+    def region(self, box, size):
+        """Part of the basemap (left, top, right, bottom in full resolution pixels) shown at this size,
+            for zooming and panning"""
+        left, top, right, bottom = box
+        number = self.level_for(size[0] / max(right - left, 1))
+        level_width, level_height = self.sizes[number]
+        x_scale = level_width / self.width
+        y_scale = level_height / self.height
+        # Only this part of the level is read, then resized the rest of the way
+        rows = slice(max(int(top * y_scale), 0), min(int(np.ceil(bottom * y_scale)), level_height))
+        columns = slice(max(int(left * x_scale), 0), min(int(np.ceil(right * x_scale)), level_width))
+        pixels = Image.fromarray(np.ascontiguousarray(self.level(number)[rows, columns]))
+        return pixels.resize(size, Image.LANCZOS)
+
+    def rows(self, top, bottom):
+        """Full resolution rows of the basemap, e.g. for drawing onto it a strip at a time"""
+        return Image.fromarray(np.ascontiguousarray(self.level(0)[top:bottom]))
+
+def build_pyramid(filename, folder):
+    """Decode the image once and save it and each halving of it as .npy files, along with their sizes"""
+    with Image.open(filename) as image:
+        image = image.convert('RGBA' if image.has_transparency_data else 'RGB')
+    # Built next to where it's going and then renamed, so a half written pyramid is never used
+    temporary_folder = f"{folder}.{os.getpid()}.tmp"
+    os.makedirs(temporary_folder, exist_ok=True)
+    sizes = []
+    while True:
+        np.save(os.path.join(temporary_folder, f"{len(sizes)}.npy"), np.asarray(image))
+        sizes.append(image.size)
+        if max(image.size) <= SMALLEST_LEVEL:
+            break
+        image = image.reduce(2)
+    with open(os.path.join(temporary_folder, "levels.json"), 'w') as file:
+        json.dump(sizes, file)
+    try:
+        os.replace(temporary_folder, folder)
+    except OSError:
+        # Another process built the same pyramid first
+        shutil.rmtree(temporary_folder, ignore_errors=True)
@@ -0,0 +1,200 @@
+# Benchmarks the routing pipeline on generated networks, and compares the results against a stored baseline.
+#   python benchmark.py                  run every generator at every size, and compare against the baseline
+#   python benchmark.py --record         run them and save the results as the new baseline
+#   python benchmark.py --sizes 100 1000 --generators grid streets --memory
+#   python benchmark.py --sizes 100000   the largest networks (many_odd takes several minutes at this size)
+#   python benchmark.py --cold-start     check how long a new Lambda container takes to import lambda_function
+
+import argparse
+from collections import Counter
+import json
+import math
+import random
+import subprocess
+import sys
+
+from double_edges import automatic_matching
+from instrumentation import instrumented
+from path_variables import source_directory
+from pipeline import solve_components
+from spatial_index import GridIndex
+
+BASELINE_FILENAME = source_directory / "benchmark_baseline.json"
+SIZES = (100, 1000, 10000)
+# Timings within this many seconds of the baseline are just noise, whatever the percentage
+NOISE_SECONDS = 0.05
+# Importing lambda_function is most of a Lambda cold start (NumPy alone takes about 0.1s)
+IMPORT_BUDGET_SECONDS = 0.25
+
+# Run in a new interpreter, like a new Lambda container: import the handler and then handle its example request
+COLD_START_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import lambda_function
+imported = time.perf_counter()
+edges = [[[244, 313], [309, 421]], [[309, 421], [420, 359]], [[420, 359], [244, 313]], [[244, 313], [350, 237]],
+         [[350, 237], [420, 359]], [[350, 237], [557, 134]]]
+lambda_function.lambda_handler({"body": json.dumps({"edges": edges})}, None)
+print(json.dumps({"import_seconds": imported - start, "first_request_seconds": time.perf_counter() - imported}))
+"""
+
+def grid_network(size, seed=0, spacing=50):
+    """A square grid with about this many edges"""
+    side = max(int(math.sqrt(size / 2)), 2)
+    edges = []
+    for i in range(side):
+        for j in range(side):
+            if i + 1 < side:
+                edges.append(((i * spacing, j * spacing), ((i + 1) * spacing, j * spacing)))
+            if j + 1 < side:
+                edges.append(((i * spacing, j * spacing), (i * spacing, (j + 1) * spacing)))
+    return edges
+
+def random_geometric_network(size, seed=0):
+    """Random points, each connected to its two nearest neighbours"""
+    generator = random.Random(seed)
+    width = 50 * math.sqrt(size)
+    points = list({(generator.randint(0, int(width)), generator.randint(0, int(width))) for _ in range(size // 2)})
+    index = GridIndex.from_points(points)
+    edges = set()
+    for point in points:
+        for other in index.nearest(point, 2):
+            edges.add((min(point, other), max(point, other)))
+    return sorted(edges)
+
+def street_network(size, seed=0):
+    """A grid whose streets are drawn as chains of short, slightly wiggly edges, like imported street data"""
+    generator = random.Random(seed)
+    edges = []
+    for node1, node2 in grid_network(size // 5, seed):
+        pieces = generator.randint(2, 8)
+        points = [node1]
+        for i in range(1, pieces):
+            points.append((node1[0] + (node2[0] - node1[0]) * i // pieces + generator.randint(-3, 3),
+                           node1[1] + (node2[1] - node1[1]) * i // pieces + generator.randint(-3, 3)))
+        points.append(node2)
+        edges.extend(zip(points[:-1], points[1:]))
+    return edges
+
+def many_odd_network(size, seed=0):
+    """A random tree, where each new point joins the nearest point so far, so most of the nodes are odd"""
+    generator = random.Random(seed)
+    width = 50 * math.sqrt(size)
+    first = (int(width) // 2, int(width) // 2)
+    index = GridIndex(50)
+    index.insert(first)
+    seen = {first}
+    edges = []
+    while len(edges) < size:
+        point = (generator.randint(0, int(width)), generator.randint(0, int(width)))
+        if point in seen:
+            continue
+        edges.append((index.nearest(point, 1)[0], point))
+        index.insert(point)
+        seen.add(point)
+    return edges
+
+GENERATORS = {
+    "grid": grid_network,
+    "random_geometric": random_geometric_network,
+    "streets": street_network,
+    "many_odd": many_odd_network,
+}
+
+def run_benchmark(name, size, memory=False, repeat=3):
+    """Route one generated network, returning its stage timings and enough of the result to spot a change in it.
+        The fastest of a few runs is kept, since the slower ones are mostly other things happening on the machine."""
+    edges = GENERATORS[name](size)
+    degrees = Counter(node for edge in edges for node in edge)
+    odd_nodes = sum(degree % 2 for degree in degrees.values())
+    matching = automatic_matching(odd_nodes)
+    report = None
+    for _ in range(repeat):
+        with instrumented(memory=memory) as instrumentation:
+            routes = solve_components(edges, matching, processes=1)
+        if report is None or instrumentation.seconds < report["seconds"]:
+            report = instrumentation.report()
+    double_edges = sum(len(route["path"]) for route in routes) - len(edges)
+    doubled_distance = sum(math.dist(*edge) for route in routes for edge in route["path"]) - sum(math.dist(*edge) for edge in edges)
+    result = {
+        "edges": len(edges),
+        "matching": matching,
+        "seconds": report["seconds"],
+        "stages": {stage: timing["seconds"] for stage, timing in report["stages"].items()},
+        "counts": report["counts"],
+        "double_edges": double_edges,
+        "doubled_distance": round(doubled_distance, 6),
+    }
+    if memory:
+        result["peak_bytes"] = report["peak_bytes"]
+    return result
+
+def cold_start(repeat=5):
+    """The fastest import time and first request time out of a few new interpreters"""
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", COLD_START_SCRIPT], cwd=source_directory, capture_output=True,
+                                text=True, check=True).stdout
+        runs.append(json.loads(output.splitlines()[-1]))
+    return {key: min(run[key] for run in runs) for key in runs[0]}
+
+def compare(result, baseline, tolerance):
+    """The ways this result is worse than the baseline: slower (beyond the tolerance), using more memory,
+        or doubling up more distance"""
+    problems = []
+    if result["seconds"] > baseline["seconds"] * (1 + tolerance) and result["seconds"] - baseline["seconds"] > NOISE_SECONDS:
+        problems.append(f"{result['seconds']:.3f}s vs {baseline['seconds']:.3f}s")
+    if "peak_bytes" in result and "peak_bytes" in baseline and result["peak_bytes"] > baseline["peak_bytes"] * (1 + tolerance):
+        problems.append(f"peak {result['peak_bytes']} vs {baseline['peak_bytes']} bytes")
+    if result["doubled_distance"] > baseline["doubled_distance"] + 1e-6:
+        problems.append(f"doubled distance {result['doubled_distance']} vs {baseline['doubled_distance']}")
+    return problems
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Benchmark the routing pipeline on generated networks")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="roughly how many edges in each network")
+    parser.add_argument("--generators", nargs="+", default=list(GENERATORS), choices=list(GENERATORS))
+    parser.add_argument("--memory", action="store_true", help="also record the peak memory (slows the pipeline down)")
+    parser.add_argument("--record", action="store_true", help="save the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="how much slower than the baseline is allowed")
+    parser.add_argument("--repeat", type=int, default=3, help="how many times to run each network, keeping the fastest")
+    parser.add_argument("--baseline", default=BASELINE_FILENAME)
+    parser.add_argument("--cold-start", action="store_true", help=f"just check importing lambda_function takes less "
+                                                                   f"than {IMPORT_BUDGET_SECONDS}s")
+    arguments = parser.parse_args(arguments)
+
+    if arguments.cold_start:
+        timings = cold_start()
+        within_budget = timings["import_seconds"] <= IMPORT_BUDGET_SECONDS
+        print(f"import {timings['import_seconds']:.3f}s (budget {IMPORT_BUDGET_SECONDS}s), "
+              f"first request {timings['first_request_seconds']:.3f}s  {'ok' if within_budget else 'OVER BUDGET'}")
+        return 0 if within_budget else 1
+
+    try:
+        with open(arguments.baseline, 'r') as file:
+            baseline = json.load(file)
+    except FileNotFoundError:
+        baseline = {}
+
+    results = {}
+    regressions = 0
+    for name in arguments.generators:
+        for size in arguments.sizes:
+            key = f"{name}/{size}"
+            results[key] = result = run_benchmark(name, size, arguments.memory, arguments.repeat)
+            stages = ", ".join(f"{stage} {seconds:.3f}" for stage, seconds in result["stages"].items())
+            problems = compare(result, baseline[key], arguments.tolerance) if key in baseline else []
+            status = "REGRESSION " + "; ".join(problems) if problems else ("ok" if key in baseline else "no baseline")
+            regressions += len(problems) > 0
+            print(f"{key:24} {result['edges']:7} edges {result['seconds']:8.3f}s  {status}\n    {stages}")
+
+    if arguments.record:
+        baseline.update(results)
+        with open(arguments.baseline, 'w') as file:
+            json.dump(baseline, file, indent=2, sort_keys=True)
+        print(f"Saved the baseline to {arguments.baseline}")
+        return 0
+    return 1 if regressions > 0 else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,79 @@
+from compact_graph import CompactGraph
+
+def contract_chains(graph):
+    """Replace each chain of degree 2 nodes with a single edge between the nodes at its ends, as long as the whole chain.
+        Curves get drawn (and streets get imported) as many short edges, but the odd nodes and the shortest paths
+        between them are the same in the contracted graph, so the matching has far fewer nodes to search through.
+        Returns the contracted graph, and the original nodes along each of its edges keyed on the edge's end nodes.
+        If there aren't any chains to contract then the graph is returned as it is, with None instead of the chains."""
+    offsets, neighbours, slot_pairs, slot_lengths = graph.adjacency_lists()
+    degrees = graph.degrees.tolist()
+    # A node with a self loop also has degree 2, but it's a dead end rather than part of a chain
+    interior = [degrees[node] == 2 and offsets[node + 1] - offsets[node] == 2 for node in range(len(graph.nodes))]
+    if not any(interior):
+        return graph, None
+    visited = [False] * len(graph.pair_nodes)
+
+    def follow(start, slot):
+        """Walk out from the start node through this slot until the end of the chain.
+            Returns the nodes along the chain, and the distance along the chain to each of them."""
+        chain = [start]
+        distances = [0]
+        while True:
+            visited[slot_pairs[slot]] = True
+            node = neighbours[slot]
+            chain.append(node)
+            distances.append(distances[-1] + slot_lengths[slot])
+            if not interior[node] or node == start:
+                return chain, distances
+            # Carry on out the other side of the node
+            first = offsets[node]
+            slot = first + 1 if slot_pairs[first] == slot_pairs[slot] else first
+
+    found = []
+    for start in range(len(graph.nodes)):
+        if not interior[start]:
+            for slot in range(offsets[start], offsets[start + 1]):
+                if not visited[slot_pairs[slot]]:
+                    found.append(follow(start, slot))
+    # Anything left over is a cycle made only of degree 2 nodes
+    for start in range(len(graph.nodes)):
+        if interior[start] and not visited[slot_pairs[offsets[start]]]:
+            found.append(follow(start, offsets[start]))
+
+    # Two chains between the same pair of nodes would get merged into one edge, and a chain that comes back to where
+    # it started would become a self loop. So these chains keep one or two of their nodes to split them up.
+    # The original edges claim their pair of nodes first, since they can't be split.
+    used = {tuple(sorted((chain[0], chain[-1]))) for chain, _ in found if len(chain) == 2}
+    edges = []
+    lengths = []
+    chains = {}
+    for chain, distances in sorted(found, key=lambda item: len(item[0])):
+        key = tuple(sorted((chain[0], chain[-1])))
+        if len(chain) == 2:
+            cuts = [0, 1]
+        elif chain[0] == chain[-1]:
+            cuts = [0, (len(chain) - 1) // 3, 2 * (len(chain) - 1) // 3, len(chain) - 1]
+        elif key in used:
+            cuts = [0, len(chain) // 2, len(chain) - 1]
+        else:
+            used.add(key)
+            cuts = [0, len(chain) - 1]
+        for start, end in zip(cuts[:-1], cuts[1:]):
+            nodes = [graph.nodes[node] for node in chain[start:end + 1]]
+            edges.append((nodes[0], nodes[-1]))
+            lengths.append(distances[end] - distances[start])
+            chains[(nodes[0], nodes[-1])] = nodes
+    return CompactGraph(edges, lengths=lengths), chains
+
+def expand_chains(edges, chains):
+    """Replace each contracted edge with the original edges along its chain"""
+    if chains is None:
+        return edges
+    expanded = []
+    for node1, node2 in edges:
+        chain = chains.get((node1, node2))
+        if chain is None:
+            chain = chains[(node2, node1)][::-1]
+        expanded.extend(zip(chain[:-1], chain[1:]))
+    return expanded
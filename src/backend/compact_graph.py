@@ -0,0 +1,139 @@
+import numpy as np
+
+def edge_key(edge):
+    """The same key for an edge whichever direction it was drawn in"""
+    node1, node2 = tuple(edge[0]), tuple(edge[1])
+    return (node1, node2) if node1 <= node2 else (node2, node1)
+
+def coordinate_dtype(coordinates):
+    """'int32' if the coordinates fit in integers (nodes drawn on the canvas are whole pixels), otherwise 'float64'"""
+    coordinates = np.asarray(coordinates, dtype=float)
+    integral = np.all(coordinates == np.round(coordinates)) and np.all(np.abs(coordinates) < 2 ** 31)
+    return 'int32' if integral else 'float64'
+
+class CompactGraph:
+    """An undirected multigraph stored in flat arrays, instead of networkx's dictionaries per node and per edge.
+
+    Nodes are interned as integer ids in the order they first appear, and their coordinates are kept in a NumPy array.
+    Each distinct pair of nodes is stored once, with a multiplicity for the parallel edges (e.g. the double edges).
+    The adjacency is in CSR form: the neighbours of node i are neighbours[offsets[i]:offsets[i + 1]], in the order
+    they were first connected (the same order networkx would give), and slot_pairs maps each slot back to its pair.
+    directions holds the unit vector from each slot's node towards its neighbour, for choosing the straightest turn.
+    Each edge is as long as the straight line between its nodes, unless lengths are given for the edges
+    (e.g. the contracted chains in chains.py), in which case parallel edges keep the shortest length."""
+
+    def __init__(self, edges, double_edges=(), lengths=None):
+        node_ids = {}
+        pair_ids = {}
+        pair_nodes = []
+        multiplicity = []
+        for edge_list in (edges, double_edges):
+            for edge in edge_list:
+                node1 = node_ids.setdefault(tuple(edge[0]), len(node_ids))
+                node2 = node_ids.setdefault(tuple(edge[1]), len(node_ids))
+                key = (node1, node2) if node1 <= node2 else (node2, node1)
+                pair = pair_ids.get(key)
+                if pair is None:
+                    pair_ids[key] = len(pair_nodes)
+                    pair_nodes.append((node1, node2))
+                    multiplicity.append(1)
+                else:
+                    multiplicity[pair] += 1
+
+        self.node_ids = node_ids
+        self.nodes = list(node_ids)
+        self.coordinates = np.array(self.nodes, dtype=float).reshape(-1, 2)
+        self.pair_nodes = np.array(pair_nodes, dtype=np.int32).reshape(-1, 2)
+        self.multiplicity = np.array(multiplicity, dtype=np.int32)
+        if lengths is None:
+            differences = self.coordinates[self.pair_nodes[:, 0]] - self.coordinates[self.pair_nodes[:, 1]]
+            self.lengths = np.sqrt(np.sum(np.square(differences), axis=1))
+        else:
+            self.lengths = np.full(len(pair_nodes), np.inf)
+            for edge, length in zip(edges, lengths):
+                node1, node2 = node_ids[tuple(edge[0])], node_ids[tuple(edge[1])]
+                pair = pair_ids[(node1, node2) if node1 <= node2 else (node2, node1)]
+                self.lengths[pair] = min(self.lengths[pair], length)
+        self.build_adjacency()
+        self._adjacency_lists = None
+
+    @classmethod
+    def from_arrays(cls, coordinates, edge_nodes):
+        """The same graph as CompactGraph(edges), built from an array of node coordinates and an (n, 2) array of the
+            node indices at each end of each edge (e.g. from an EdgeStore), without making a tuple for every edge.
+            The nodes are renumbered in the order the edges first reach them, and repeated pairs are counted in the
+            multiplicity, just like the constructor does."""
+        graph = cls.__new__(cls)
+        edge_nodes = np.asarray(edge_nodes, dtype=np.int64).reshape(-1, 2)
+        used, first_seen, renumbered = np.unique(edge_nodes.ravel(), return_index=True, return_inverse=True)
+        order = np.argsort(first_seen, kind='stable')
+        new_ids = np.empty(len(used), dtype=np.int64)
+        new_ids[order] = np.arange(len(used))
+        ends = new_ids[renumbered.ravel()].reshape(-1, 2)
+
+        # Each pair keeps the direction and position of its first edge
+        keys = np.minimum(ends[:, 0], ends[:, 1]) * len(used) + np.maximum(ends[:, 0], ends[:, 1])
+        _, first_edge, pair_of_edge, counts = np.unique(keys, return_index=True, return_inverse=True, return_counts=True)
+        pair_order = np.argsort(first_edge, kind='stable')
+
+        graph.coordinates = np.asarray(coordinates, dtype=float).reshape(-1, 2)[used[order]]
+        graph.nodes = [tuple(node) for node in np.asarray(coordinates)[used[order]].tolist()]
+        graph.node_ids = {node: node_id for node_id, node in enumerate(graph.nodes)}
+        graph.pair_nodes = ends[first_edge[pair_order]].astype(np.int32).reshape(-1, 2)
+        graph.multiplicity = counts[pair_order].astype(np.int32)
+        differences = graph.coordinates[graph.pair_nodes[:, 0]] - graph.coordinates[graph.pair_nodes[:, 1]]
+        graph.lengths = np.sqrt(np.sum(np.square(differences), axis=1))
+        graph.build_adjacency()
+        graph._adjacency_lists = None
+        return graph
+
+    def build_adjacency(self):
+        """Sort both ends of every pair by node (then by pair, i.e. by first connection) to get the CSR arrays"""
+        number_of_nodes = len(self.nodes)
+        pair_indices = np.arange(len(self.pair_nodes), dtype=np.int32)
+        ends = np.concatenate([self.pair_nodes[:, 0], self.pair_nodes[:, 1]])
+        others = np.concatenate([self.pair_nodes[:, 1], self.pair_nodes[:, 0]])
+        slot_pairs = np.concatenate([pair_indices, pair_indices])
+
+        # Like networkx, a self loop counts twice towards the degree but only appears once as a neighbour
+        self.degrees = np.bincount(ends, minlength=number_of_nodes)
+        self.open_degrees = np.bincount(ends, weights=np.concatenate([self.multiplicity, self.multiplicity]),
+                                        minlength=number_of_nodes).astype(np.int64)
+        keep = np.concatenate([np.ones(len(pair_indices), dtype=bool), self.pair_nodes[:, 0] != self.pair_nodes[:, 1]])
+        ends, others, slot_pairs = ends[keep], others[keep], slot_pairs[keep]
+
+        order = np.lexsort((slot_pairs, ends))
+        self.neighbours = others[order]
+        self.slot_pairs = slot_pairs[order]
+        self.offsets = np.zeros(number_of_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(ends, minlength=number_of_nodes), out=self.offsets[1:])
+
+        # Self loops have no direction, so they get NaN like the cosine distance would give them
+        vectors = self.coordinates[self.neighbours] - self.coordinates[ends[order]]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.directions = vectors / np.linalg.norm(vectors, axis=1)[:, np.newaxis]
+
+    def adjacency_lists(self):
+        """The CSR arrays as Python lists (offsets, neighbours, slot_pairs, slot_lengths), which are much faster to
+            read one element at a time in the search and walk loops than NumPy arrays"""
+        if self._adjacency_lists is None:
+            self._adjacency_lists = (self.offsets.tolist(), self.neighbours.tolist(), self.slot_pairs.tolist(),
+                                     self.lengths[self.slot_pairs].tolist())
+        return self._adjacency_lists
+
+    def odd_nodes(self):
+        return np.flatnonzero(self.degrees % 2 == 1).tolist()
+
+    def edge_coordinates(self, edges):
+        """Convert edges between node ids back into edges between the original coordinates"""
+        return [(self.nodes[node1], self.nodes[node2]) for node1, node2 in edges]
+
+    def to_networkx(self):
+        """Build the equivalent networkx MultiGraph keyed on coordinates, as a reference for checking results"""
+        import networkx as nx
+        graph = nx.MultiGraph()
+        graph.add_nodes_from(self.nodes)
+        for (node1, node2), count, length in zip(self.pair_nodes.tolist(), self.multiplicity.tolist(), self.lengths.tolist()):
+            for _ in range(count):
+                graph.add_edge(self.nodes[node1], self.nodes[node2], distance=length)
+        return graph
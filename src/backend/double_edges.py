@@ -1,58 +1,203 @@
-import networkx as nx
-import itertools
+import heapq
+import importlib.util
+import time
 from collections import Counter
 import numpy as np
 
+from chains import contract_chains, expand_chains
+from compact_graph import CompactGraph
+from edge_store import EdgeStore
+from instrumentation import count, stage
+from matching import (SMALL_MATCHING_MAX_NODES, add_candidate, candidate_pairs, greedy_matching, improve_matching,
+                      matching_pairs, matching_partners, small_exact_matching)
+from spatial_index import GridIndex
+
+# networkx is only needed for the blossom matching in the exact and sparse strategies, and it's the slowest module to
+# import (which matters for Lambda cold starts), so it only gets imported the first time one of them needs it
+HAS_NETWORKX = importlib.util.find_spec('networkx') is not None
+
 # Most of this script was taken from https://www.datacamp.com/community/tutorials/networkx-python-graph-tutorial#solution
 
-def choose_double_edges(edges):
-    """Use a brute force approach to choose the optimal double edges"""
-    g = create_graph(edges)
-    g_aug = evenify_graph(g)
-    if g_aug is None:
+# exact: blossom matching over every pair of odd nodes (optimal, but roughly cubic in the number of odd nodes)
+# sparse: blossom matching, but only between each odd node and its k nearest odd nodes
+# greedy: pair up the closest odd nodes first, only considering each odd node's nearest neighbours
+# greedy_2opt: greedy, followed by swapping partners while that shortens the doubled distance
+MATCHING_STRATEGIES = ('exact', 'sparse', 'greedy', 'greedy_2opt')
+K_NEAREST = 10
+# The exact matching is roughly cubic in the number of odd nodes, so networks with more use the approximate matching
+EXACT_MAX_ODD_NODES = 200
+
+def choose_double_edges(edges, matching='exact', k_nearest=K_NEAREST):
+    """Choose the double edges, using the exact matching by default or one of the faster approximate strategies.
+        The matching runs on the graph with its chains of degree 2 nodes contracted, which are then expanded again."""
+    with stage('create_graph'):
+        g = create_graph(edges)
+    with stage('contract_chains'):
+        g, chains = contract_chains(g)
+    count('edges', len(edges))
+    count('contracted_nodes', len(g.nodes))
+    odd_matching, predecessors = evenify_graph(g, matching, k_nearest)
+    if odd_matching is None:
         return []
-    double_edges = expand_edges(g_aug, g)
+    with stage('expand_edges'):
+        double_edges = expand_edges(g, odd_matching, predecessors)
+        double_edges = expand_chains(g.edge_coordinates(double_edges), chains)
+    count('double_edges', len(double_edges))
     return double_edges
 
+def automatic_matching(number_of_odd_nodes):
+    """The exact matching when it's quick enough, otherwise greedy_2opt"""
+    return 'exact' if number_of_odd_nodes <= EXACT_MAX_ODD_NODES else 'greedy_2opt'
+
 def create_graph(edges):
-    """Construct a networkx graph from a list of edges"""
-    graph = nx.Graph()
-    for edge in edges:
-        euclidian_distance = np.linalg.norm(np.array(edge[0]) - np.array(edge[1]))
-        graph.add_edge(edge[0], edge[1], distance=euclidian_distance)
-    return graph
-
-def evenify_graph(g):
-    """Adds edges to the graph to ensure all nodes have even degree"""
-    nodes_odd_degree = [node for node, degree in g.degree if degree % 2 == 1]
-    odd_node_pairs = list(itertools.combinations(nodes_odd_degree, 2))
-
-    # Find the shortest distance between any two nodes (using Djikstra)
-    distances = get_shortest_paths_distances(g, odd_node_pairs, 'distance')     # If we don't use the distance, then we just get the number of steps
-    if distances is None or len(distances) == 0:
-        return None
+    """Construct a compact graph from a list of edges (or straight from the arrays of an EdgeStore),
+        with the nodes as integer ids"""
+    if isinstance(edges, EdgeStore):
+        return edges.graph()
+    return CompactGraph(edges)
+
+def evenify_graph(g, matching='exact', k_nearest=K_NEAREST):
+    """Choose the pairs of odd nodes to connect so that all nodes have even degree.
+        Also returns the shortest path trees from the odd nodes, for expanding the new edges later"""
+    if matching not in MATCHING_STRATEGIES:
+        raise ValueError(f"Unknown matching strategy {matching!r}, expected one of {MATCHING_STRATEGIES}")
+    if matching in ('exact', 'sparse') and not HAS_NETWORKX:
+        raise ImportError(f"The {matching} matching strategy needs networkx, use greedy or greedy_2opt instead")
+    nodes_odd_degree = g.odd_nodes()
+    count('odd_nodes', len(nodes_odd_degree))
+    if len(nodes_odd_degree) == 0:
+        return None, None
 
-    # Choose the edges that maximise the overall weight. (without using any node twice)
-    # Note: This is a brute force approach, might need to look into a less accurate but more efficient method later
-    g_odd_complete = create_complete_graph(distances)
-    odd_matching = nx.algorithms.max_weight_matching(g_odd_complete)
+    if matching == 'exact':
+        # Find the shortest distance between any two nodes (using one Djikstra search per odd node)
+        with stage('shortest_paths'):
+            distances, predecessors = get_shortest_paths_distances(g, nodes_odd_degree)
+        if distances is None or len(distances) == 0:
+            return None, None
 
-    # Add these new edges to the graph
-    g_aug = add_augmenting_path_to_graph(g, odd_matching)
-    return g_aug
+        # Choose the edges that maximise the overall weight. (without using any node twice)
+        # Note: This is a brute force approach, use one of the approximate strategies for large networks
+        with stage('matching'):
+            if len(nodes_odd_degree) <= SMALL_MATCHING_MAX_NODES:
+                odd_matching = small_exact_matching(nodes_odd_degree, distances)
+            else:
+                import networkx as nx
+                g_odd_complete = create_complete_graph(distances)
+                # The furthest pair has a weight of 0, so it has to be told to pair up every node or it can leave that pair out
+                odd_matching = nx.algorithms.max_weight_matching(g_odd_complete, maxcardinality=True)
+    else:
+        with stage('shortest_paths'):
+            candidates, predecessors = get_nearest_candidates(g, nodes_odd_degree, k_nearest)
+        with stage('matching'):
+            odd_matching = approximate_matching(g, nodes_odd_degree, candidates, predecessors, k_nearest, matching)
+        if odd_matching is None:
+            return None, None
 
-def get_shortest_paths_distances(graph, pairs, edge_weight_name):
-    """Compute shortest distance between each pair of nodes in a graph. Return a dictionary keyed on node pairs (tuples)."""
+    return odd_matching, predecessors
+
+def get_shortest_paths_distances(graph, nodes):
+    """Compute shortest distance between each pair of nodes in a graph, with a single search from each node.
+        Return a dictionary keyed on node pairs (tuples), and the predecessor tree of each search keyed on its source."""
+    distances = {}
+    predecessors = {}
+    for i, source in enumerate(nodes):
+        # The search from each node only needs to reach the nodes after it, since the graph is undirected
+        targets = nodes[i + 1:]
+        if len(targets) == 0:
+            break
+        source_distances, predecessors[source] = dijkstra_to_targets(graph, source, targets)
+        for target in targets:
+            if target not in source_distances:
+                return None, None
+            distances[(source, target)] = source_distances[target]
+    return distances, predecessors
+
+def dijkstra_to_targets(graph, source, targets):
+    """Single source Dijkstra that stops as soon as every target has been settled.
+        Returns the settled distances and the predecessor of each node on its shortest path from the source."""
+    offsets, neighbours, _, slot_lengths = graph.adjacency_lists()
+    remaining = set(targets)
     distances = {}
-    for pair in pairs:
-        try:
-            distances[pair] = nx.dijkstra_path_length(graph, pair[0], pair[1], weight=edge_weight_name)
-        except nx.exception.NetworkXNoPath:
-            return None
-    return distances
+    predecessors = {}
+    tentative = {source: 0}
+    heap = [(0, source, None)]
+    while heap and remaining:
+        distance, node, predecessor = heapq.heappop(heap)
+        if node in distances:
+            continue
+        # Only settled nodes go in the tree, so every path read from it is a shortest path
+        distances[node] = distance
+        predecessors[node] = predecessor
+        remaining.discard(node)
+        for slot in range(offsets[node], offsets[node + 1]):
+            neighbour = neighbours[slot]
+            new_distance = distance + slot_lengths[slot]
+            if neighbour not in tentative or new_distance < tentative[neighbour]:
+                tentative[neighbour] = new_distance
+                heapq.heappush(heap, (new_distance, neighbour, node))
+    return distances, predecessors
+
+def get_nearest_candidates(graph, nodes, k_nearest):
+    """Compute the shortest distance from each node to its k nearest nodes (as the crow flies).
+        Each search stops once those few nodes are settled, instead of reaching every other node."""
+    index = GridIndex.from_points([graph.nodes[node] for node in nodes], nodes)
+    candidates = {}
+    predecessors = {}
+    for source in nodes:
+        targets = index.nearest(graph.nodes[source], k_nearest)
+        source_distances, predecessors[source] = dijkstra_to_targets(graph, source, targets)
+        for target in targets:
+            if target in source_distances:
+                add_candidate(candidates, source, target, source_distances[target])
+    return candidates, predecessors
+
+def approximate_matching(graph, nodes, candidates, predecessors, k_nearest=K_NEAREST, matching='greedy'):
+    """Pair up the nodes using just the candidate distances, with either the sparse or greedy strategies.
+        Returns None if some of the nodes can't be paired up because the graph is disjoint."""
+    if matching == 'sparse':
+        partners = sparse_matching(candidates)
+    else:
+        partners = greedy_matching(candidates)
+
+    # Any nodes whose candidates all got taken are paired up with their nearest unmatched nodes.
+    # If that stops making progress then we fall back to a full search between just those nodes.
+    unmatched = [node for node in nodes if node not in partners]
+    while len(unmatched) > 0:
+        leftovers, unmatched_predecessors = get_nearest_candidates(graph, unmatched, k_nearest)
+        new_partners = greedy_matching(leftovers)
+        if len(new_partners) == 0:
+            distances, unmatched_predecessors = get_shortest_paths_distances(graph, unmatched)
+            if distances is None:
+                return None
+            leftovers = {}
+            for pair, distance in distances.items():
+                add_candidate(leftovers, pair[0], pair[1], distance)
+            new_partners = greedy_matching(leftovers)
+        for node1, others in leftovers.items():
+            for node2, distance in others.items():
+                add_candidate(candidates, node1, node2, distance)
+        for source, tree in unmatched_predecessors.items():
+            predecessors.setdefault(source, {}).update(tree)
+        partners.update(new_partners)
+        unmatched = [node for node in unmatched if node not in partners]
+
+    if matching == 'greedy_2opt':
+        partners = improve_matching(partners, candidates)
+    return matching_pairs(partners)
+
+def sparse_matching(candidates):
+    """Choose the candidate pairs that maximise the overall weight, without building the complete graph of odd nodes"""
+    if len(candidates) == 0:
+        return {}
+    import networkx as nx
+    g_odd_sparse = create_complete_graph(candidate_pairs(candidates))
+    # Not every node is guaranteed a partner in a sparse graph, so prefer matching as many nodes as possible
+    odd_matching = nx.algorithms.max_weight_matching(g_odd_sparse, maxcardinality=True)
+    return matching_partners(odd_matching)
 
 def create_complete_graph(pair_weights):
     """Adds weights based on the distances"""
+    import networkx as nx
     g = nx.Graph()
     max_distance = max(pair_weights.values())
     for k, v in pair_weights.items():
@@ -60,35 +205,72 @@ def create_complete_graph(pair_weights):
         g.add_edge(k[0], k[1], weight=-v + max_distance)
     return g
 
-def add_augmenting_path_to_graph(graph, min_weight_pairs):
-    """Add the min weight matching edges to the original graph"""
-    # We need to make the augmented graph a MultiGraph so we can add parallel edges
-    graph_aug = nx.MultiGraph(graph.copy())
-    for pair in min_weight_pairs:
-        graph_aug.add_edge(pair[0], pair[1])
-    return graph_aug
+def expand_edges(graph, odd_matching, predecessors=None):
+    """Fix up the new edges that didn't exist in the original graph by connecting a string of initial edges.
+        The paths are read from the predecessor trees of evenify_graph when available. Returns just the double edges."""
+    double_edges = []
+    for node1, node2 in odd_matching:
+        aug_path = matched_path(graph, predecessors, node1, node2)
+        aug_path_pairs = list(zip(aug_path[:-1], aug_path[1:]))
+        double_edges.extend(aug_path_pairs)
 
+    # The exact matching never overlaps, but the approximate ones can send two paths along the same edge.
+    # Any odd numbered edges get added to the double edges once & any even numbered edges cancel out.
+    edge_counts = Counter(tuple(sorted(edge)) for edge in double_edges)
+    kept_edges = set()
+    odd_edges = []
+    for edge in double_edges:
+        key = tuple(sorted(edge))
+        if edge_counts[key] % 2 == 1 and key not in kept_edges:
+            kept_edges.add(key)
+            odd_edges.append(edge)
+    return odd_edges
 
-def expand_edges(graph_augmented, graph_original):
-    """Fix up the new edges in the graph that didn't exist in the original by connecting a string of initial edges.
-        returns just the double edges."""
-    double_edges = []
-    for edge in graph_augmented.edges:
-        # Doubled up edges
-        if edge[2] == 1:
-            double_edges.append((edge[0], edge[1]))
-        # Rural postman edges
-        elif edge[:2] not in graph_original.edges:
-            aug_path = nx.shortest_path(graph_original, edge[0], edge[1], weight='distance')
-            aug_path_pairs = list(zip(aug_path[:-1], aug_path[1:]))
-            double_edges.extend(aug_path_pairs)
-
-    # TODO: Make sure none of the edges get recorded more than once. (Any odd numbered edges should get added to the double edges & Any even should numbered edges in double edges get removed.)
-    edge_counts = Counter(double_edges)
-    rerecorded_edges = [e for e in edge_counts.values() if e != 1]
-    assert len(rerecorded_edges) == 0, "Still need to ensure edges don't get duplicated!"
+def matched_path(graph, predecessors, node1, node2):
+    """The nodes along the edges that get doubled up to connect a matched pair of odd nodes"""
+    # Read from the searches rather than checking for an edge between the pair first,
+    # since a contracted chain between the pair can be the long way round
+    aug_path = cached_shortest_path(predecessors, node1, node2)
+    if aug_path is None:
+        _, tree = dijkstra_to_targets(graph, node1, [node2])
+        aug_path = path_from_predecessors(tree, node2)
+    return aug_path
 
-    return double_edges
+def cached_shortest_path(predecessors, source, target):
+    """Read the shortest path between two nodes from the predecessor trees, or None if neither tree reaches it"""
+    if predecessors is None:
+        return None
+    if source in predecessors and target in predecessors[source]:
+        return path_from_predecessors(predecessors[source], target)
+    if target in predecessors and source in predecessors[target]:
+        return path_from_predecessors(predecessors[target], source)[::-1]
+    return None
+
+def path_from_predecessors(tree, target):
+    """Walk back through a predecessor tree from the target to the source of the search"""
+    path = [target]
+    while tree[path[-1]] is not None:
+        path.append(tree[path[-1]])
+    return path[::-1]
+
+def doubled_distance(double_edges):
+    """The total length of the edges that get travelled twice"""
+    return sum(np.linalg.norm(np.array(edge[0]) - np.array(edge[1])) for edge in double_edges)
+
+def compare_matching_strategies(edges, k_nearest=K_NEAREST):
+    """Run every matching strategy on the same edges, and report the extra distance each one doubles up compared to exact"""
+    report = {}
+    for strategy in MATCHING_STRATEGIES:
+        start = time.perf_counter()
+        double_edges = choose_double_edges(edges, strategy, k_nearest)
+        report[strategy] = {
+            "doubled_distance": doubled_distance(double_edges),
+            "seconds": time.perf_counter() - start,
+        }
+    exact_distance = report['exact']["doubled_distance"]
+    for strategy in MATCHING_STRATEGIES:
+        report[strategy]["extra_distance"] = report[strategy]["doubled_distance"] - exact_distance
+    return report
 
 if __name__ == '__main__':
     ## Route that requires double edges
@@ -102,4 +284,7 @@ if __name__ == '__main__':
     edges = []
 
     double_edges = choose_double_edges(edges)
-    print("double_edges", double_edges)
\ No newline at end of file
+    print("double_edges", double_edges)
+
+    ## Compare the approximate matchings against the exact matching
+    # print(compare_matching_strategies(edges))
\ No newline at end of file
@@ -0,0 +1,81 @@
+import json
+import os
+import struct
+import numpy as np
+
+from compact_graph import CompactGraph, coordinate_dtype
+
+# The file is a 32 byte header (the magic, the node dtype, and the numbers of nodes and edges), then each node's x and
+# y, then the indices of the two nodes at the ends of each edge as int32s, all little endian. Both arrays start on an
+# 8 byte boundary, so they can be memory mapped straight from the file.
+MAGIC = b'RADEDGE1'
+HEADER = struct.Struct('<8s8sQQ')
+NODE_DTYPES = {'int32': np.dtype('<i4'), 'float64': np.dtype('<f8')}
+EDGE_DTYPE = np.dtype('<i4')
+
+class EdgeStore:
+    """A network loaded from the binary edge format. The arrays are memory mapped, so loading is instant however big
+        the network is, and graph() builds the CompactGraph from them directly instead of going through a list of
+        coordinate tuples. It can also be passed to choose_double_edges, which builds its graph with graph().
+        The editor and the rest of the pipeline (split_components, euler_path) work on coordinate tuples, so for
+        those the edges are still turned into tuples, by edges() or by iterating over the store."""
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as file:
+            magic, node_dtype, number_of_nodes, number_of_edges = HEADER.unpack(file.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{filename} isn't a binary edge file")
+        node_dtype = NODE_DTYPES[node_dtype.rstrip(b'\0').decode('ascii')]
+        self.coordinates = open_memmap(filename, node_dtype, HEADER.size, (number_of_nodes, 2))
+        self.edge_nodes = open_memmap(filename, EDGE_DTYPE, HEADER.size + node_dtype.itemsize * 2 * number_of_nodes,
+                                      (number_of_edges, 2))
+
+    def __len__(self):
+        return len(self.edge_nodes)
+
+    def __iter__(self):
+        return iter(self.edges())
+
+    def edges(self):
+        """The edges as pairs of coordinate tuples, for code that wants them one at a time (e.g. the editor)"""
+        nodes = [tuple(node) for node in self.coordinates.tolist()]
+        return [(nodes[node1], nodes[node2]) for node1, node2 in self.edge_nodes.tolist()]
+
+    def graph(self):
+        return CompactGraph.from_arrays(self.coordinates, self.edge_nodes)
+
+def open_memmap(filename, dtype, offset, shape):
+    # np.memmap can't map an empty array
+    if shape[0] == 0:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=shape)
+
+def save_edge_store(filename, edges):
+    """Write the edges in the binary format, numbering the nodes in the order the edges first reach them"""
+    ends = np.asarray(edges, dtype=float).reshape(-1, 2)
+    coordinates, first_seen, node_of_end = np.unique(ends, axis=0, return_index=True, return_inverse=True)
+    order = np.argsort(first_seen, kind='stable')
+    new_ids = np.empty(len(order), dtype=np.int64)
+    new_ids[order] = np.arange(len(order))
+    coordinates = coordinates[order]
+    edge_nodes = new_ids[node_of_end.ravel()].reshape(-1, 2)
+
+    node_dtype = coordinate_dtype(coordinates)
+    # Written to a temporary file first, so a crash never leaves half a network behind
+    temporary_filename = f"{filename}.{os.getpid()}.tmp"
+    with open(temporary_filename, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, node_dtype.encode('ascii'), len(coordinates), len(edge_nodes)))
+        file.write(coordinates.astype(NODE_DTYPES[node_dtype]).tobytes())
+        file.write(edge_nodes.astype(EDGE_DTYPE).tobytes())
+    os.replace(temporary_filename, filename)
+
+def load_edges(filename, json_filename=None):
+    """Load the binary edge file, first converting the JSON edges into it if there's no binary file yet, or the JSON
+        file has changed since. Returns None if there are no edges to load."""
+    if json_filename is not None and os.path.exists(json_filename):
+        if not os.path.exists(filename) or os.path.getmtime(json_filename) > os.path.getmtime(filename):
+            with open(json_filename, 'r') as file:
+                save_edge_store(filename, json.load(file))
+    if not os.path.exists(filename):
+        return None
+    return EdgeStore(filename)
@@ -1,125 +1,173 @@
-import networkx as nx
+from collections import Counter, defaultdict, deque
 import numpy as np
 
+from compact_graph import CompactGraph
+
+HEAD = -1   # Position before the first edge of the route
+
+class DisjointGraph(ValueError):
+    """There's no route through every edge, because the graph is in more than one piece"""
+
 def euler_path(edges, double_edges):
     """Create a route through the graph that is easy to follow and avoids turning back on itself"""
     if len(edges) == 0:
         return [], []
+    path = []
+    colours = []
+    try:
+        for edge, colour in route_segments(edges, double_edges):
+            path.append(edge)
+            colours.append(colour)
+    except DisjointGraph:
+        return None, None
+    return path, colours
+
+def route_segments(edges, double_edges):
+    """Generate the same route as euler_path one (edge, colour) at a time, as soon as each edge's place is settled,
+        so the start of a long route can be sent on while the rest of it is still being walked"""
+    if len(edges) == 0:
+        return
 
     graph = create_multi_graph(edges, double_edges)
-    last_edge = list(graph.edges)[0]
-    ordered_edges = [last_edge[:2]]
-    graph.remove_edge(last_edge[0], last_edge[1])
-    insertion_index = 1
-    loop_size = 0
-
-    current_loop = ordered_edges.copy()
-    intersections = []
-    loops = []
+    offsets, neighbours, slot_pairs, _ = graph.adjacency_lists()
+    remaining = graph.multiplicity.tolist()         # How many more times each pair of nodes needs to be travelled
+    open_degrees = graph.open_degrees.tolist()      # How many untravelled edges are left at each node
+    remaining_edges = sum(remaining)
+
+    # The first pair always sits in the first slot of the first node
+    last_edge = tuple(graph.pair_nodes[0].tolist())
+    last_slot = offsets[last_edge[0]]
+    remaining[0] -= 1
+    open_degrees[last_edge[0]] -= 1
+    open_degrees[last_edge[1]] -= 1
+    remaining_edges -= 1
+
+    # The route is stored as a linked list, so that backtracking can splice a new loop into the middle in constant time.
+    # Edges get inserted after the cursor, and route_next/route_previous hold the neighbouring indices in route_edges.
+    # route_slots records the slot each edge was travelled through, for looking up its direction.
+    route_edges = [last_edge]
+    route_slots = [last_slot]
+    route_next = [None]
+    route_previous = [HEAD]
+    route_start = 0
+    cursor = 0
+
+    # A loop only ever gets spliced in just before an edge whose first node still has untravelled edges, or (when
+    # some nodes have odd degree, so a loop can end somewhere else) just before the edge after the cursor. So the
+    # route is settled up to the first of those edges, and everything before it can be sent on.
+    # Each edge's colour depends on the node after it, so the colours trail one edge behind.
+    tracker = LoopTracker()
+    sent = HEAD
+    unsent_edge = None
 
     # Choose edges one at a time, and remove them from the graph.
-    while(len(graph.edges())) > 0:
-        possibilities = graph.adj[last_edge[1]]
+    while remaining_edges > 0:
+        following = route_start if sent == HEAD else route_next[sent]
+        after_cursor = route_start if cursor == HEAD else route_next[cursor]
+        while following is not None and following != after_cursor and open_degrees[route_edges[following][0]] == 0:
+            colour = tracker.add(route_edges[following][0])
+            if unsent_edge is not None:
+                yield (graph.nodes[unsent_edge[0]], graph.nodes[unsent_edge[1]]), colour
+            unsent_edge = route_edges[following]
+            sent = following
+            following = route_next[sent]
+
+        if open_degrees[last_edge[1]] == 0:
+            cursor, last_edge, last_slot = backtrack(cursor, route_edges, route_slots, route_previous, open_degrees)
+        possibilities = [slot for slot in range(offsets[last_edge[1]], offsets[last_edge[1] + 1]) if remaining[slot_pairs[slot]] > 0]
+        possibilities = prioritise_double_edges(possibilities, slot_pairs, remaining)
         if len(possibilities) == 0:
-            insertion_index, last_edge = backtrack(insertion_index, ordered_edges, graph.adj)
-            possibilities = graph.adj[last_edge[1]]
-        possibilities = list(prioritise_double_edges(possibilities))
-        try:
-            next_node = choose_next_node(last_edge, possibilities)
-        except:
             # This is likely because the graph is disjoint
-            return None, None
-        graph.remove_edge(last_edge[1], next_node)
+            raise DisjointGraph("Some edges can't be reached from the start of the route")
+        slot = choose_next_node(graph.directions, last_slot, possibilities)
+        next_node = neighbours[slot]
+        remaining[slot_pairs[slot]] -= 1
+        open_degrees[last_edge[1]] -= 1
+        open_degrees[next_node] -= 1
+        remaining_edges -= 1
         last_edge = (last_edge[1], next_node)
-        ordered_edges.insert(insertion_index, last_edge)
-        
-        intersections = [index if index <= insertion_index else index + 1 for index in intersections]
-        insertion_index += 1
-        loop_size += 1
-
-        # Start a new loop if we intersect with this loop and the intersection results in a loop larger than intersect_lenience + 1
-        in_current_loop = next_node in {item for sublist in current_loop for item in sublist}
-        intersect_lenience = 5
-        in_last_n = next_node in {item for sublist in current_loop[-intersect_lenience:] for item in sublist}
-        if in_current_loop and not in_last_n:
-            intersections.append(insertion_index)
-            current_loop.append(last_edge)
-            loops.append(current_loop)
-            current_loop = []
-            continue
-        current_loop.append(last_edge)
-
-    colours = separate_loops(ordered_edges)
-    return ordered_edges, colours
-
-def separate_loops(ordered_edges):
-    """Give each loop a separate index for determining colours"""
-    nodes = [edge[0] for edge in ordered_edges]
-    colour_dict = {0:[]}
-    current_loop = []   
-    colours = []
-    loop_number = 0
-    lenience = 5
-    for node in nodes:
-        if node in colour_dict[loop_number] and node not in current_loop[-lenience:]:
-            loop_number = (loop_number + 1) % 20    # We only have 20 colours
-            current_loop = []
-        colours.append(loop_number)
-        current_loop.append(node)
-        if loop_number not in colour_dict:
-            colour_dict[loop_number] = []
-        colour_dict[loop_number].append(node)
-
+        last_slot = slot
+
+        # Splice the new edge in after the cursor
+        new_index = len(route_edges)
+        following = route_start if cursor == HEAD else route_next[cursor]
+        route_edges.append(last_edge)
+        route_slots.append(last_slot)
+        route_next.append(following)
+        route_previous.append(cursor)
+        if cursor == HEAD:
+            route_start = new_index
+        else:
+            route_next[cursor] = new_index
+        if following is not None:
+            route_previous[following] = new_index
+        cursor = new_index
+
+    # Everything left is settled now that every edge has been travelled
+    index = route_start if sent == HEAD else route_next[sent]
+    while index is not None:
+        colour = tracker.add(route_edges[index][0])
+        if unsent_edge is not None:
+            yield (graph.nodes[unsent_edge[0]], graph.nodes[unsent_edge[1]]), colour
+        unsent_edge = route_edges[index]
+        index = route_next[index]
     # Make each loop end one short to avoid colours running into each other
-    colours.append(loop_number)
-    colours = colours[1:]
-    return colours
-
-def prioritise_double_edges(possibilities):
+    yield (graph.nodes[unsent_edge[0]], graph.nodes[unsent_edge[1]]), tracker.loop_number
+
+class LoopTracker:
+    """Keeps track of which loop the route is on, one node at a time.
+        A node that is already in the current loop (but not among its last few nodes) starts a new loop.
+        Each loop keeps a count of its nodes, and a ring buffer holds the current loop's last few nodes,
+        so every step is constant time instead of searching through the lists of nodes."""
+
+    def __init__(self, number_of_colours=20, lenience=5):
+        self.number_of_colours = number_of_colours    # We only have 20 colours
+        self.loop_number = 0
+        self.loop_nodes = defaultdict(Counter)
+        self.recent_nodes = deque(maxlen=lenience)
+        self.recent_counts = Counter()
+
+    def add(self, node):
+        """Add the next node of the route, and return the loop number it belongs to"""
+        if self.loop_nodes[self.loop_number][node] > 0 and self.recent_counts[node] == 0:
+            self.loop_number = (self.loop_number + 1) % self.number_of_colours
+            self.recent_nodes.clear()
+            self.recent_counts.clear()
+        if len(self.recent_nodes) == self.recent_nodes.maxlen:
+            self.recent_counts[self.recent_nodes[0]] -= 1
+        self.recent_nodes.append(node)
+        self.recent_counts[node] += 1
+        self.loop_nodes[self.loop_number][node] += 1
+        return self.loop_number
+
+def prioritise_double_edges(possibilities, slot_pairs, remaining):
     """Choose the double edges first to help avoid turning back on yourself"""
-    doubled = [k for k, v in possibilities.items() if len(v) > 1]
+    doubled = [slot for slot in possibilities if remaining[slot_pairs[slot]] > 1]
     return doubled if len(doubled) > 0 else possibilities
 
-def backtrack(insertion_index, ordered_edges, adjacencies):
+def backtrack(cursor, route_edges, route_slots, route_previous, open_degrees):
     """Find the last node where we could have gone in a different direction"""
-    while insertion_index > 0:
-        insertion_index -= 1
-        last_edge = ordered_edges[insertion_index]
-        if len(adjacencies[last_edge[0]]) > 0:
+    while cursor != HEAD:
+        edge = route_edges[cursor]
+        cursor = route_previous[cursor]
+        if open_degrees[edge[0]] > 0:
             break
-    if insertion_index == 0:
-        last_edge = [last_edge[0], last_edge[0]]
-    else:
-        last_edge = ordered_edges[insertion_index - 1]
-    return insertion_index, last_edge
-
-def choose_next_node(last_edge, possibilities):
-    """Choose the node that is most in a straight line"""
-    current_gradient = np.array(last_edge[0]) - np.array(last_edge[1])
-    possible_gradients = np.array(last_edge[1]) - possibilities
-    similarities = [cosine_distance(current_gradient, p) for p in possible_gradients]
-    node_index = np.argmin(similarities)
-    next_node = possibilities[node_index]
-    return next_node
-
-# Reproducing scipy.spatial.distance.cosine with numpy to avoid an extra dependency
-def cosine_similarity(a, b):
-    dot_product = np.dot(a, b)
-    norm_a = np.linalg.norm(a)
-    norm_b = np.linalg.norm(b)
-    return dot_product / (norm_a * norm_b)
-
-def cosine_distance(a, b):
-    return 1 - cosine_similarity(a, b)
+    if cursor == HEAD:
+        # Back at the start there is no previous edge, so no direction to carry on in
+        return cursor, (edge[0], edge[0]), None
+    return cursor, route_edges[cursor], route_slots[cursor]
+
+def choose_next_node(directions, last_slot, possibilities):
+    """Choose the slot whose edge carries on most in a straight line from the last edge.
+        The cosine distance between the two edges is 1 minus the dot product of their unit direction vectors."""
+    if last_slot is None or len(possibilities) == 1:
+        return possibilities[0]
+    similarities = 1 - directions[possibilities] @ directions[last_slot]
+    return possibilities[np.argmin(similarities)]
 
 def create_multi_graph(edges, double_edges):
     """Combine the single and double edges into a graph"""
-    graph = nx.MultiGraph()
-    for edge in edges:
-        graph.add_edge(edge[0], edge[1])
-    for edge in double_edges:
-        graph.add_edge(edge[0], edge[1])
-    return graph
+    return CompactGraph(edges, double_edges)
 
 if __name__ == '__main__':
     ## Route that requires double edges
@@ -139,4 +187,45 @@ if __name__ == '__main__':
     path, colours = euler_path(edges, double_edges)
 
     print("path", path)
-    print("colours", colours)
\ No newline at end of file
+    print("colours", colours)
+
+    ## Regression check against routes recorded from the original implementation (before the linked list splicing)
+    recorded_routes = [
+        ([[(244, 313), (309, 421)], [(309, 421), (420, 359)], [(420, 359), (244, 313)], [(244, 313), (350, 237)],
+          [(350, 237), (420, 359)], [(350, 237), (557, 134)]],
+         [((244, 313), (420, 359)), ((350, 237), (557, 134))],
+         [((244, 313), (309, 421)), ((309, 421), (420, 359)), ((420, 359), (244, 313)), ((244, 313), (350, 237)),
+          ((350, 237), (557, 134)), ((557, 134), (350, 237)), ((350, 237), (420, 359)), ((420, 359), (244, 313))],
+         [0, 0, 0, 0, 0, 0, 0, 0]),
+        ([[(10, 10), (60, 10)], [(10, 10), (10, 60)], [(10, 60), (60, 60)], [(10, 60), (10, 110)], [(10, 110), (60, 110)],
+          [(60, 10), (110, 10)], [(60, 10), (60, 60)], [(60, 60), (110, 60)], [(60, 60), (60, 110)], [(60, 110), (110, 110)],
+          [(110, 10), (110, 60)], [(110, 60), (110, 110)]],
+         [((60, 10), (60, 60)), ((60, 60), (110, 60)), ((10, 60), (10, 110)), ((10, 110), (60, 110))],
+         [((10, 10), (60, 10)), ((60, 10), (60, 60)), ((60, 60), (110, 60)), ((110, 60), (110, 10)), ((110, 10), (60, 10)),
+          ((60, 10), (60, 60)), ((60, 60), (60, 110)), ((60, 110), (10, 110)), ((10, 110), (10, 60)), ((10, 60), (60, 60)),
+          ((60, 60), (110, 60)), ((110, 60), (110, 110)), ((110, 110), (60, 110)), ((60, 110), (10, 110)),
+          ((10, 110), (10, 60)), ((10, 60), (10, 10))],
+         [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 1, 1]),
+        # Odd degree nodes, so the loop spliced in at the start ends somewhere else
+        ([[(48, 30), (41, 33)], [(48, 49), (48, 30)], [(42, 1), (48, 49)], [(48, 34), (48, 30)]],
+         [((48, 30), (48, 34))],
+         [((48, 30), (48, 34)), ((48, 34), (48, 30)), ((48, 30), (48, 49)), ((48, 49), (42, 1)), ((48, 30), (41, 33))],
+         [0, 0, 0, 0, 0]),
+    ]
+    for edges, double_edges, recorded_path, recorded_colours in recorded_routes:
+        path, colours = euler_path(edges, double_edges)
+        assert path == recorded_path, f"Route changed: {path}"
+        assert colours == recorded_colours, f"Colours changed: {colours}"
+    print("Recorded routes match")
+
+    ## The compact payloads should decode back to the same routes, including ones that jump between edges
+    ## (the odd degree route above, and an edge listed twice, which leaves its nodes with odd degree)
+    from payload import compact_payload, expand_payload
+    from pipeline import solve_components
+    routes = [{"path": recorded_path, "colours": recorded_colours}
+              for _, _, recorded_path, recorded_colours in recorded_routes]
+    routes += solve_components([((100, 0), (50, 80)), ((50, 80), (0, 0)), ((0, 0), (100, 0)), ((0, 0), (0, -100)),
+                                ((0, 0), (0, -100))])
+    for binary in (False, True):
+        assert expand_payload(compact_payload(routes, binary)) == routes, "Compact payload changed the routes"
+    print("Compact payloads round trip")
\ No newline at end of file
@@ -0,0 +1,186 @@
+from collections import Counter, defaultdict
+
+from compact_graph import CompactGraph, edge_key
+from double_edges import (HAS_NETWORKX, K_NEAREST, automatic_matching, dijkstra_to_targets, evenify_graph,
+                          matched_path, sparse_matching)
+from euler_path import euler_path
+from matching import add_candidate, greedy_matching
+from pipeline import split_components
+from spatial_index import GridIndex
+
+class IncrementalRouter:
+    """Keeps the odd nodes, their matching and the shortest path between each matched pair between edits.
+        Adding or removing one edge only changes the parity of its two nodes, so only those nodes, their old partners,
+        and any pairs whose path went along a removed edge need to be matched again. Everything else is kept.
+        Nothing is matched until the first call to routes(), which matches everything from scratch. Until then (and
+        after an edit that can't be matched locally) edits just keep track of the edges.
+        With no matching strategy given, each component picks one by its number of odd nodes (automatic_matching)."""
+
+    def __init__(self, edges=(), matching=None, k_nearest=K_NEAREST):
+        self.matching = matching
+        self.k_nearest = k_nearest
+        self.edges = {}
+        self.degrees = Counter()
+        for edge in edges:
+            key = edge_key(edge)
+            if key in self.edges or key[0] == key[1]:
+                continue
+            self.edges[key] = key
+            self.degrees[key[0]] += 1
+            self.degrees[key[1]] += 1
+        self.graph = None
+        self.clear_matching()
+
+    def compact_graph(self):
+        """The graph for the shortest path searches, rebuilt after each edit"""
+        if self.graph is None:
+            self.graph = CompactGraph(self.edges.values())
+        return self.graph
+
+    def clear_matching(self):
+        """Forget every pair, leaving the next call to routes() to match everything from scratch"""
+        self.partners = {}
+        self.paths = {}
+        self.path_edge_counts = Counter()
+        self.pairs_using_edge = defaultdict(set)
+        self.matched = False
+
+    def rematch_all(self):
+        """Match every odd node from scratch, one component at a time"""
+        self.clear_matching()
+        for component in split_components(list(self.edges.values())):
+            graph = CompactGraph(component)
+            matching = self.matching or automatic_matching(len(graph.odd_nodes()))
+            odd_matching, predecessors = evenify_graph(graph, matching, self.k_nearest)
+            if odd_matching is None:
+                continue
+            for node1, node2 in odd_matching:
+                path = matched_path(graph, predecessors, node1, node2)
+                self.set_pair([graph.nodes[node] for node in path])
+        self.matched = True
+
+    def set_pair(self, path):
+        node1, node2 = path[0], path[-1]
+        self.partners[node1] = node2
+        self.partners[node2] = node1
+        pair = edge_key((node1, node2))
+        self.paths[pair] = path
+        for key in map(edge_key, zip(path[:-1], path[1:])):
+            self.path_edge_counts[key] += 1
+            self.pairs_using_edge[key].add(pair)
+
+    def clear_pair(self, node):
+        """Unmatch this node and its partner, returning the partner"""
+        partner = self.partners.pop(node)
+        del self.partners[partner]
+        pair = edge_key((node, partner))
+        path = self.paths.pop(pair)
+        for key in map(edge_key, zip(path[:-1], path[1:])):
+            self.path_edge_counts[key] -= 1
+            if self.path_edge_counts[key] == 0:
+                del self.path_edge_counts[key]
+            pairs = self.pairs_using_edge.get(key)
+            if pairs is not None:
+                pairs.discard(pair)
+                if len(pairs) == 0:
+                    del self.pairs_using_edge[key]
+        return partner
+
+    def toggle_edge(self, edge):
+        """Remove the edge if it's already in the network, otherwise add it"""
+        if edge_key(edge) in self.edges:
+            self.remove_edge(edge)
+        else:
+            self.add_edge(edge)
+
+    def add_edge(self, edge):
+        key = edge_key(edge)
+        if key in self.edges or key[0] == key[1]:
+            return
+        self.edges[key] = key
+        self.update_nodes(key, 1)
+
+    def remove_edge(self, edge):
+        key = edge_key(edge)
+        if key not in self.edges:
+            return
+        del self.edges[key]
+        # Any pair whose path went along this edge needs a new path
+        affected = set()
+        for node1, _ in list(self.pairs_using_edge.pop(key, ())):
+            if node1 in self.partners:
+                affected.update((node1, self.clear_pair(node1)))
+        self.update_nodes(key, -1, affected)
+
+    def update_nodes(self, key, change, affected=None):
+        """Flip the parity of both ends of the edge, then match any nodes that have been left without a partner"""
+        affected = set() if affected is None else affected
+        for node in key:
+            self.degrees[node] += change
+            if self.degrees[node] == 0:
+                del self.degrees[node]
+            if node in self.partners:
+                affected.add(self.clear_pair(node))
+            affected.add(node)
+        self.graph = None
+        if not self.matched:
+            return
+        unmatched = [node for node in affected if self.degrees[node] % 2 == 1 and node not in self.partners]
+        if len(unmatched) > 0:
+            self.match(sorted(self.release_neighbours(unmatched)))
+
+    def release_neighbours(self, unmatched):
+        """Also unmatch the pairs of the nearest odd nodes, so the new nodes can take over their partners.
+            Otherwise the new nodes can only be paired with each other, and the route gets worse with every edit."""
+        odd_nodes = list(self.partners)
+        index = GridIndex.from_points(odd_nodes)
+        released = set(unmatched)
+        for node in unmatched:
+            for neighbour in index.nearest(node, self.k_nearest):
+                if neighbour in self.partners:
+                    released.update((neighbour, self.clear_pair(neighbour)))
+        return released
+
+    def match(self, unmatched):
+        """Match just these nodes between themselves, falling back to matching everything if they can't all be paired"""
+        graph = self.compact_graph()
+        nodes = [graph.node_ids[node] for node in unmatched]
+        candidates = {}
+        predecessors = {}
+        for i, source in enumerate(nodes):
+            targets = nodes[i + 1:]
+            if len(targets) == 0:
+                break
+            distances, predecessors[source] = dijkstra_to_targets(graph, source, targets)
+            for target in targets:
+                if target in distances:
+                    add_candidate(candidates, source, target, distances[target])
+        partners = sparse_matching(candidates) if HAS_NETWORKX else greedy_matching(candidates)
+        if len(partners) < len(nodes):
+            # The edit split the network, so these nodes have to be paired up with nodes that were already matched.
+            # That means matching everything again, which is left for routes() rather than slowing down the edit.
+            self.clear_matching()
+            return
+        for node1, node2 in partners.items():
+            if node1 < node2:
+                path = matched_path(graph, predecessors, node1, node2)
+                self.set_pair([graph.nodes[node] for node in path])
+
+    def double_edges(self):
+        """Edges used by an odd number of paths get doubled, and the rest cancel out (like expand_edges)"""
+        return [key for key, count in self.path_edge_counts.items() if count % 2 == 1]
+
+    def routes(self):
+        """One route per component, in the same form as pipeline.solve_components"""
+        if not self.matched:
+            self.rematch_all()
+        components = split_components(list(self.edges.values()))
+        component_of_node = {node: i for i, component in enumerate(components) for edge in component for node in edge}
+        component_double_edges = [[] for _ in components]
+        for edge in self.double_edges():
+            component_double_edges[component_of_node[edge[0]]].append(edge)
+        routes = []
+        for component, double_edges in zip(components, component_double_edges):
+            path, colours = euler_path(component, double_edges)
+            routes.append({"path": path, "colours": colours})
+        return routes
@@ -0,0 +1,105 @@
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+import contextvars
+import io
+import json
+import logging
+import time
+import tracemalloc
+
+logger = logging.getLogger('radpath')
+
+# The instrumentation collecting for the current request, if any. A context variable keeps concurrent requests apart.
+current_instrumentation = contextvars.ContextVar('current_instrumentation', default=None)
+
+class Instrumentation:
+    """Timings (and optionally peak memory) for each stage of the routing, along with the sizes of the graphs.
+        Stages that run more than once (e.g. once per component) add up. Stages shouldn't be nested when sampling
+        memory, since each stage resets the peak."""
+
+    def __init__(self, memory=False, profile=False):
+        self.memory = memory
+        self.profile = profile
+        self.stages = {}
+        self.counts = Counter()
+        self.seconds = 0
+        self.peak_bytes = 0
+        self.profile_stats = None
+
+    @contextmanager
+    def stage(self, name):
+        stage = self.stages.setdefault(name, {"seconds": 0, "calls": 0})
+        if self.memory:
+            tracemalloc.reset_peak()
+            start_bytes = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stage["seconds"] += time.perf_counter() - start
+            stage["calls"] += 1
+            if self.memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                self.peak_bytes = max(self.peak_bytes, peak)
+                stage["peak_bytes"] = max(stage.get("peak_bytes", 0), peak - start_bytes)
+
+    def report(self):
+        report = {"seconds": self.seconds, "stages": self.stages, "counts": dict(self.counts)}
+        if self.memory:
+            report["peak_bytes"] = self.peak_bytes
+        if self.profile_stats is not None:
+            report["profile"] = self.profile_stats
+        return report
+
+@contextmanager
+def instrumented(memory=False, profile=False):
+    """Collect the stages run inside this block. Peak memory comes from tracemalloc, which slows everything down
+        a few times over, and the profile is the top of a cProfile report, so both are only there when asked for."""
+    instrumentation = Instrumentation(memory, profile)
+    token = current_instrumentation.set(instrumentation)
+    started_tracing = memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    profiler = None
+    if profile:
+        # Only imported when asked for, to keep them out of the Lambda cold start
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    start = time.perf_counter()
+    try:
+        yield instrumentation
+    finally:
+        instrumentation.seconds = time.perf_counter() - start
+        if profiler is not None:
+            profiler.disable()
+            import pstats
+            text = io.StringIO()
+            pstats.Stats(profiler, stream=text).sort_stats('cumulative').print_stats(25)
+            instrumentation.profile_stats = text.getvalue()
+        if memory:
+            instrumentation.peak_bytes = max(instrumentation.peak_bytes, tracemalloc.get_traced_memory()[1])
+        if started_tracing:
+            tracemalloc.stop()
+        current_instrumentation.reset(token)
+
+def stage(name):
+    """Time this block as a stage of the current instrumentation (or do nothing if nothing is being collected)"""
+    instrumentation = current_instrumentation.get()
+    return nullcontext() if instrumentation is None else instrumentation.stage(name)
+
+def count(name, value):
+    """Add to one of the counts of the current instrumentation, e.g. the number of odd nodes"""
+    instrumentation = current_instrumentation.get()
+    if instrumentation is not None:
+        instrumentation.counts[name] += value
+
+def log_report(event, instrumentation, **fields):
+    """Log the report as a single line of JSON (leaving out the profile, which is only for the response)"""
+    report = instrumentation.report()
+    report.pop("profile", None)
+    logger.info(json.dumps({"event": event, **fields, **report}))
+
+def attach_report(route_json, instrumentation):
+    """Add the report to a JSON response body, for requests that asked to see it"""
+    return json.dumps({**json.loads(route_json), "instrumentation": instrumentation.report()})
@@ -0,0 +1,77 @@
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+import threading
+
+from pipeline import solve_to_json
+from route_cache import edge_set_key
+
+class QueueFull(Exception):
+    """There are already as many jobs waiting as the queue allows"""
+
+class JobQueue:
+    """Computes routes in a pool of worker processes, so a large map doesn't hold up the request that submitted it.
+        Jobs are identified by the edge_set_key of their edges, so submitting the same network again while it's
+        still being computed just returns the existing job, and finished results are read back from the route cache.
+        Submitting raises QueueFull once max_pending jobs are waiting, rather than letting the backlog grow forever."""
+
+    def __init__(self, route_cache, processes=None, max_pending=16, max_finished=1000):
+        self.route_cache = route_cache
+        self.executor = ProcessPoolExecutor(max_workers=processes)
+        self.max_pending = max_pending
+        self.max_finished = max_finished
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def submit(self, edges):
+        """Start computing the route for these edges (unless it's already cached or in progress), returning the job id"""
+        job_id = edge_set_key(edges)
+        with self.lock:
+            future = self.jobs.get(job_id)
+            if future is not None and not (future.done() and future.exception() is not None):
+                return job_id
+            route_json = self.route_cache.get(job_id)
+            if route_json is not None:
+                future = Future()
+                future.set_result(route_json)
+            else:
+                if self.pending() >= self.max_pending:
+                    raise QueueFull(f"There are already {self.max_pending} jobs waiting")
+                future = self.executor.submit(solve_to_json, edges)
+                future.add_done_callback(lambda done: self.finish(job_id, done))
+            self.jobs[job_id] = future
+            self.jobs.move_to_end(job_id)
+            self.forget_finished()
+        return job_id
+
+    def finish(self, job_id, future):
+        if future.exception() is None:
+            self.route_cache.put(job_id, future.result())
+
+    def pending(self):
+        return sum(not future.done() for future in self.jobs.values())
+
+    def forget_finished(self):
+        """Drop the oldest finished jobs once there are too many, since their results are still in the route cache"""
+        finished = [job_id for job_id, future in self.jobs.items() if future.done()]
+        for job_id in finished[:max(len(finished) - self.max_finished, 0)]:
+            del self.jobs[job_id]
+
+    def status(self, job_id):
+        """One of queued, running, done or failed (with the error), or None if there's no such job"""
+        future = self.jobs.get(job_id)
+        if future is None:
+            return None
+        if not future.done():
+            return {"status": "running" if future.running() else "queued"}
+        if future.exception() is not None:
+            return {"status": "failed", "error": f"{type(future.exception()).__name__}: {future.exception()}"}
+        return {"status": "done"}
+
+    def result(self, job_id):
+        """The route JSON of a finished job, or None if it isn't finished (or has been forgotten and evicted)"""
+        future = self.jobs.get(job_id)
+        if future is None:
+            return self.route_cache.get(job_id)
+        if future.done() and future.exception() is None:
+            return future.result()
+        return None
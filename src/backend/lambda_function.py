@@ -2,43 +2,84 @@
 # server.py is used for deploying local backend for the React App
 # main.py is a standalone tkinter python app 
 
-from double_edges import choose_double_edges
-from euler_path import euler_path
+from instrumentation import logger
+from pipeline import UnknownFormat, solve_batch, solve_request, solve_to_ndjson
+from route_cache import RouteCache
 import json
+import logging
+
+# The Lambda runtime sends INFO logs to CloudWatch once the logger lets them through
+logger.setLevel(logging.INFO)
+
+# Warm Lambda containers keep this between invocations, so resubmitted networks skip the routing entirely
+route_cache = RouteCache()
+
+# Only the first invocation of each container pays for the cold start (see benchmark.py --cold-start for the budget).
+# Slow modules like networkx are imported the first time they're needed, rather than here.
+cold_start = True
 
 def lambda_handler(event, context):
-    print("event: ", event)
+    global cold_start
+    was_cold_start, cold_start = cold_start, False
 
     edges = []
     if (event['body']) and (event['body'] is not None):
         body = json.loads(event['body'])
+    if 'edge_sets' in body:
+        return batch_results(body['edge_sets'])
     try:
         edges = body['edges']
     except KeyError:
-        print('Invalid json body for radpath')
+        logger.warning('Invalid json body for radpath')
 
     edge_tuples = [[tuple(node) for node in edge] for edge in edges]
-    print("edge_tuples", edge_tuples)
 
-    double_edges = choose_double_edges(edge_tuples)
-    print("double_edges", double_edges)
-    
-    path, colours = euler_path(edge_tuples, double_edges)
+    # The Python runtime can't stream a response, but NDJSON clients still get the same lines as from server.py
+    headers = {key.lower(): value for key, value in (event.get('headers') or {}).items()}
+    if "application/x-ndjson" in headers.get('accept', ''):
+        return {
+            "statusCode": 200,
+            "headers": {
+                "Content-Type": "application/x-ndjson",
+                "Access-Control-Allow-Origin":"*",
+            },
+            "body": "".join(solve_to_ndjson(edge_tuples))
+        }
+
+    # Large maps can ask for the compact payload (compact_binary packs its arrays as base64 text)
+    try:
+        route_json, cache_hit = solve_request(edge_tuples, body, route_cache, cold_start=was_cold_start)
+    except UnknownFormat as error:
+        return {
+            "statusCode": 400,
+            "headers": {
+                "Content-Type": "application/json",
+                "Access-Control-Allow-Origin":"*",
+            },
+            "body": json.dumps({"error": str(error)})
+        }
     results = {
         "statusCode": 200,
         "headers": {
             "Content-Type": "*/*",
-            "Access-Control-Allow-Origin":"*"
+            "Access-Control-Allow-Origin":"*",
+            "X-Radpath-Cache": "hit" if cache_hit else "miss",
         },
-        "body": json.dumps({
-            "path":path, 
-            "colours":colours,
-        })
+        "body": route_json
     }
-
-    print("results: ", results)
     return results
 
+def batch_results(edge_sets):
+    """Route a list of networks, with a result for each one in the same order"""
+    return {
+        "statusCode": 200,
+        "headers": {
+            "Content-Type": "*/*",
+            "Access-Control-Allow-Origin":"*",
+        },
+        "body": json.dumps({"results": solve_batch(edge_sets)})
+    }
+
 if __name__ == '__main__':
     body = {
         "edges":[[[244, 313], [309, 421]], [[309, 421], [420, 359]], [[420, 359], [244, 313]], [[244, 313], [350, 237]],
@@ -1,22 +1,34 @@
+from collections import Counter
 import tkinter as tk
 from tkinter import font as tkFont
 from tkinter import filedialog
-from PIL import ImageTk, Image
+from PIL import ImageTk
 import numpy as np
 import json
 import matplotlib.pyplot as plt
 import shutil
 import os
-import io
+import threading
 
-from double_edges import choose_double_edges
-from euler_path import euler_path
+from basemap import BasemapPyramid
+from compact_graph import edge_key
+from edge_store import load_edges, save_edge_store
+from incremental import IncrementalRouter
 from path_variables import data_folder
+from route_export import export_route
+from route_image import ROUTE_OFFSET, offset_segments, route_overlay
+from spatial_index import GridIndex
 
 CIRCLE_SIZE = 10
 DOUBLE_EDGE_WIDTH = 5
 BACKGROUND_FILENAME = data_folder / "map.png"
 EDGES_FILENAME = data_folder / "edges.json"
+# The edges are saved here, and converted from edges.json whenever that's newer (e.g. after uploading edges)
+EDGE_STORE_FILENAME = data_folder / "edges.bin"
+# Draw the route as a single image over the background, rather than a canvas line for every edge of the route
+RASTER_ROUTE = True
+# One of double_edges.MATCHING_STRATEGIES, or None to use the exact matching unless there are too many odd nodes
+MATCHING = None
 
 class Radpath:
 
@@ -40,6 +52,7 @@ class Radpath:
 
         self.background = self.setup_background(BACKGROUND_FILENAME) 
         self.canvas_background = self.canvas.create_image(0, 0, image=self.background, anchor='nw')
+        self.route_image = None
 
         button_font = tkFont.Font(size=16, weight='bold')
         button_background = 'black'
@@ -58,14 +71,23 @@ class Radpath:
         self.message_label = tk.Label(root, text="-----------------------")
         self.message_label.grid(row=0, column=0, padx=10, pady=120, sticky="nw")
 
-        self.nodes = []
-        self.node_drawings = []
-        self.edges = []
-        self.edge_drawings = []
+        # Nodes and edges are looked up by hashing rather than scanning, so each click takes the same time however
+        # big the network is. Edges are keyed by edge_key, so it doesn't matter which way round they were drawn.
+        self.node_drawings = {}
+        self.node_index = GridIndex(CIRCLE_SIZE)
+        self.node_degrees = Counter()
+        self.edges = {}
+        # Only built the first time a route is generated, since matching a big network can take a while
+        self.router = None
+        self.route_thread = None
+        self.edge_drawings = {}
         self.loop_drawings = []
         self.number_drawings = []
 
-        self.double_edges = []
+        self.path = []
+        self.colours = []
+        self.export_thread = None
+
         self.last_press = None
         self.last_line = None
         self.new_node = True
@@ -75,6 +97,8 @@ class Radpath:
 
     def upload_basemap(self):
         """Override the current map.png with the new image"""
+        if self.calculating():
+            return
         filename = filedialog.askopenfilename()
         # TODO: Check the file is a png, and if not then give an error message
         self.map_name, _ = os.path.splitext(os.path.basename(filename))
@@ -82,21 +106,25 @@ class Radpath:
         old_filename = os.path.join(data_folder, os.path.basename(filename))
         new_filename = os.path.join(data_folder, "map.png")
         os.rename(old_filename, new_filename)
+        self.clear_route()
         self.background = self.setup_background(BACKGROUND_FILENAME) 
         self.canvas_background = self.canvas.create_image(0, 0, image=self.background, anchor='nw')
         self.preload_edges()
 
     def setup_background(self, BACKGROUND_FILENAME):
         """Prepare the image to be used as a tkinter background"""
-        background_image = Image.open(BACKGROUND_FILENAME)
-        background_image = self.rescale_background(background_image, self.screen_width, self.screen_height)
+        # Only decoded the first time we see this image, after that the cached pyramid is read instead
+        self.basemap = BasemapPyramid.load(BACKGROUND_FILENAME)
+        background_image = self.rescale_background(self.basemap, self.screen_width, self.screen_height)
+        # Kept so the route overlay can be drawn over it
+        self.background_image = background_image
         return ImageTk.PhotoImage(background_image)
 
-    def rescale_background(self, background_image, screen_width, screen_height):
+    def rescale_background(self, basemap, screen_width, screen_height):
         """Adjust the image size to use the full screen width/height but without distorting the image"""
         screen_ratio = screen_width/screen_height
-        image_width = background_image.width
-        image_height = background_image.height
+        image_width = basemap.width
+        image_height = basemap.height
         image_ratio = image_width/image_height
         if image_ratio >= screen_ratio:
             image_width = screen_width
@@ -104,23 +132,27 @@ class Radpath:
         else:
             image_height = screen_height
             image_width = image_height * image_ratio
-        background_image = background_image.resize((int(image_width), int(image_height)), Image.LANCZOS)
-        return background_image
+        # Resized from the smallest level of the pyramid that's big enough, rather than from full resolution
+        return basemap.resized((int(image_width), int(image_height)))
     
     def upload_edges(self):
         """Override the current edges.json with the new edges"""
+        if self.calculating():
+            return
         filename = filedialog.askopenfilename()
         # TODO: Check the file is a json, and if not then give an error message
-        os.remove(os.path.join(data_folder, "edges.json"))
+        # Remove the binary edges too, so the new edges.json is what gets loaded
+        for old_edges in (EDGES_FILENAME, EDGE_STORE_FILENAME):
+            if os.path.exists(old_edges):
+                os.remove(old_edges)
         shutil.copy(filename, data_folder)
         old_filename = os.path.join(data_folder, os.path.basename(filename))
         new_filename = os.path.join(data_folder, "edges.json")
         os.rename(old_filename, new_filename)
-        self.edges = []
+        self.edges = {}
+        self.router = None
         self.preload_edges()
-        for loop_drawing in self.loop_drawings:
-            self.canvas.delete(loop_drawing)
-        self.loop_drawings = []
+        self.clear_route()
 
     def download_route(self):
         """Download the basemap, edges, and an image of the route itself"""
@@ -130,81 +162,115 @@ class Radpath:
 
         downloads_path = os.path.join(os.path.expanduser("~"), 'Downloads')
         old_basemap_path = os.path.join(data_folder, "map.png")
-        old_edge_path = os.path.join(data_folder, "edges.json")
         new_basemap_path = os.path.join(downloads_path, f"{self.map_name}.png")
         new_edge_path = os.path.join(downloads_path, f"{self.map_name} - edges x{round(self.distance)}.json")
 
-        shutil.copy(old_basemap_path, new_basemap_path)
-        shutil.copy(old_edge_path, new_edge_path)
-
         new_route_path = os.path.join(downloads_path, f"{self.map_name} - route x{round(self.distance)}.png")
-        ps_data = self.canvas.postscript(colormode='color')
-        pil_image = Image.open(io.BytesIO(ps_data.encode('utf-8')))
-        pil_image.save(new_route_path, format="PNG", quality=95)
 
+        if self.export_thread is not None and self.export_thread.is_alive():
+            self.message_label.config(text="Still downloading the last route")
+            return
+
+        def download():
+            try:
+                shutil.copy(old_basemap_path, new_basemap_path)
+                # The edges are downloaded as JSON, since that's what can be uploaded again (and read by other programs)
+                with open(new_edge_path, 'w') as file:
+                    json.dump(edges, file)
+                # Drawn onto the original basemap, so the route comes out at the basemap's full resolution
+                export_route(basemap, new_route_path, path, colours, route_palette(), DOUBLE_EDGE_WIDTH, screen_width)
+            except Exception as error:
+                result["error"] = error
+
+        # Big basemaps take a while, so the download happens in the background and the window keeps responding.
+        # Tk can only be used from this thread, so we check back here to see when it's finished.
+        path, colours, edges = list(self.path), list(self.colours), list(self.edges.values())
+        basemap, screen_width = self.basemap, self.background_image.width
+        result = {}
+        self.export_thread = threading.Thread(target=download, daemon=True)
+        self.export_thread.start()
+        self.message_label.config(text="Downloading the route...")
+        self.canvas.after(200, self.check_download, result)
+
+    def check_download(self, result):
+        if self.export_thread.is_alive():
+            self.canvas.after(200, self.check_download, result)
+        elif "error" in result:
+            self.message_label.config(text=f"Couldn't download the route: {result['error']}", bg="#ffd9d9")
+        else:
+            self.message_label.config(text="Downloaded the route", bg="#d9ffe0")
 
     def clear_nodes_and_edges(self):
         """Clear all the drawings"""
-        for edge_drawing in self.edge_drawings:
+        for edge_drawing in self.edge_drawings.values():
             self.canvas.delete(edge_drawing)
-        for node_drawing in self.node_drawings:
+        for node_drawing in self.node_drawings.values():
             self.canvas.delete(node_drawing)
-        self.edge_drawings = []
-        self.node_drawings = []
+        self.edge_drawings = {}
+        self.node_drawings = {}
+        self.node_index = GridIndex(CIRCLE_SIZE)
+        self.node_degrees = Counter()
 
     def draw_nodes_and_edges(self):
         "Draw all the drawings"
-        for edge in self.edges:
-            line = self.canvas.create_line(edge[0][0], edge[0][1], edge[1][0], edge[1][1])
-            self.edge_drawings.append(line)
+        for key, edge in self.edges.items():
+            self.edge_drawings[key] = self.canvas.create_line(edge[0][0], edge[0][1], edge[1][0], edge[1][1])
+            self.node_degrees.update(key)
 
         # Extract and draw the nodes
-        nodes = set()
-        for edge in self.edges:
-            nodes.add(edge[0])
-            nodes.add(edge[1])
-        self.nodes = list(nodes)
-        for node in self.nodes:
-            circle = self.draw_node(node)
-            self.node_drawings.append(circle)
+        for node in self.node_degrees:
+            self.add_node(node)
+
+    def add_node(self, node):
+        self.node_drawings[node] = self.draw_node(node)
+        self.node_index.insert(node)
+
+    def remove_node(self, node):
+        self.canvas.delete(self.node_drawings.pop(node))
+        self.node_index.remove(node)
 
     def preload_edges(self):
         """Load from a previously saved set of edges"""
         self.clear_nodes_and_edges()
         # Load in the edges from file if the file exists
         try:
-            with open(EDGES_FILENAME, 'r') as file:
-                self.edges = json.load(file)
-                # Nodes need to be tuples for dictionary hashing to work
-                self.edges = [[tuple(edge[0]),tuple(edge[1])] for edge in self.edges]
-        except:
+            store = load_edges(EDGE_STORE_FILENAME, EDGES_FILENAME)
+        except (OSError, ValueError):
+            store = None
+        if store is None:
             print("There is no edges.json file for preloading, so we are starting from scratch")
-            return
-        self.draw_nodes_and_edges()
+        else:
+            # Nodes come out as tuples, which dictionary hashing needs
+            self.edges = {edge_key(edge): edge for edge in store.edges()}
+            self.draw_nodes_and_edges()
+        # Keep the router's matching if these are the edges it already has (e.g. reloading after calculate_route)
+        if self.router is not None and set(self.router.edges) != set(self.edges):
+            self.router = None
 
     def mouse_press(self, event):
         """If we press somewhere that doesn't yet have a node, then place a node there"""
+        self.last_press = None
+        if self.calculating():
+            return
         # 0. Clear the old route if we start editing the nodes/edges
-        if self.loop_drawings != []:
-            for loop_drawing in self.loop_drawings:
-                self.canvas.delete(loop_drawing)
-            self.loop_drawings = []
-            self.clear_nodes_and_edges()
-            self.draw_nodes_and_edges()
+        if self.loop_drawings != [] or self.route_image is not None:
+            self.clear_route()
             self.distance = 0
+            self.path = []
+            self.colours = []
 
         node = (event.x, event.y)
         self.new_node = self.overlapping_node(node) is None
         if self.new_node:
-            circle = self.draw_node(node)
-            self.nodes.append(node)
-            self.node_drawings.append(circle)
+            self.add_node(node)
         else:
             node = self.overlapping_node(node)
         self.last_press = node
 
     def mouse_drag(self, event):
         """If we press and drag, then draw a line from the last press position to the current mouse position"""
+        if self.last_press is None:
+            return
         self.canvas.delete(self.last_line)
         self.last_line = self.canvas.create_line(self.last_press[0], self.last_press[1], event.x, event.y)
 
@@ -213,6 +279,9 @@ class Radpath:
             1. if the 1st and 2nd nodes are the same and the 1st node is new then ignore it, otherwise delete it
             2. if the second node is new then create and draw it, if not then centre it
             3. if the edge is old then delete it, if not then create and draw it"""
+        if self.last_press is None:
+            # The press was ignored, since the route was being calculated
+            return
         node1 = self.last_press
         node2 = (event.x, event.y)
         node2_centred = self.overlapping_node(node2)
@@ -223,50 +292,52 @@ class Radpath:
                 self.canvas.delete(self.last_line)
                 return
             # Don't delete a node if it's connected to an edge
-            edge_nodes = {node for edge in self.edges for node in edge}
-            if node1 in edge_nodes:
+            if self.node_degrees[node1] > 0:
                 self.canvas.delete(self.last_line)
                 return
             else:
-                index = self.nodes.index(node1)
-                del self.nodes[index]
-                self.canvas.delete(self.node_drawings[index])
-                del self.node_drawings[index]
-
+                self.remove_node(node1)
                 self.canvas.delete(self.last_line)
                 return
 
         # 2. if the second node is new then create and draw it, if not then centre it
         if node2_centred is None:
-            circle = self.draw_node(node2)
-            self.nodes.append(node2)
-            self.node_drawings.append(circle)
+            self.add_node(node2)
         else:
             node2 = node2_centred
 
         # 3. if the edge is old then delete it, if not then create and draw it
         edge = [node1,node2]
-        reverse_edge = [node2, node1]
-        if edge in self.edges or reverse_edge in self.edges:
-            edge = edge if edge in self.edges else reverse_edge
-            index = self.edges.index(edge)
-            del self.edges[index]
-            self.canvas.delete(self.edge_drawings[index])
-            del self.edge_drawings[index]
+        key = edge_key(edge)
+        if key in self.edges:
+            edge = self.edges.pop(key)
+            self.canvas.delete(self.edge_drawings.pop(key))
+            self.node_degrees.subtract(key)
+            if self.router is not None:
+                self.router.remove_edge(edge)
         else:
             line = self.canvas.create_line(edge[0][0], edge[0][1], edge[1][0], edge[1][1])
-            self.edges.append(edge)
-            self.edge_drawings.append(line)
+            self.edges[key] = edge
+            self.edge_drawings[key] = line
+            self.node_degrees.update(key)
+            if self.router is not None:
+                self.router.add_edge(edge)
 
         self.canvas.delete(self.last_line)
 
+    def clear_route(self):
+        """Remove the route, whichever way it was drawn"""
+        for loop_drawing in self.loop_drawings:
+            self.canvas.delete(loop_drawing)
+        self.loop_drawings = []
+        if self.route_image is not None:
+            self.canvas.itemconfig(self.canvas_background, image=self.background)
+            self.route_image = None
+
     def overlapping_node(self, node):
         """returns the centre coordinates of the node that overlaps, or None if none overlap"""
-        for old_node in self.nodes:
-            euclidian_distance = np.sqrt(np.square(node[0] - old_node[0]) + np.square(node[1] - old_node[1]))
-            if euclidian_distance < CIRCLE_SIZE:
-                return old_node
-        return None
+        # The index's cells are CIRCLE_SIZE across, so this only checks the few cells around the click
+        return self.node_index.within(node, CIRCLE_SIZE)
 
     def draw_node(self, node):
         """Draw the node centred at the coordinate"""
@@ -274,42 +345,66 @@ class Radpath:
                                 node[1] + CIRCLE_SIZE / 2)
 
     def calculate_route(self):
-        """Make the edges that need to be repeated get drawn in bold"""
-        if self.edges == []:
+        """Work out the route in the background, then draw it"""
+        if len(self.edges) == 0:
             print("Cannot calculate route for an empty network")
             return
+        if self.calculating():
+            return
+        if self.router is None:
+            self.router = IncrementalRouter(list(self.edges.values()), MATCHING)
+
+        # Each separate part of the network gets its own route, with its own colours.
+        # After the first route, the router keeps the matching up to date with each edit, so usually only the walk
+        # is left to do. But the first route (or one after an edit that split the network) matches everything,
+        # which can take a while, so it's worked out in the background and the window keeps responding.
+        # Editing is paused until it's done, since the edits would change the router while it's being used.
+        result = {}
+        router = self.router
+
+        def solve():
+            try:
+                result["routes"] = router.routes()
+            except Exception as error:
+                result["error"] = error
+
+        self.route_thread = threading.Thread(target=solve, daemon=True)
+        self.route_thread.start()
+        self.message_label.config(text="Generating the route...")
+        self.canvas.after(50, self.check_route, result)
+
+    def calculating(self):
+        return self.route_thread is not None and self.route_thread.is_alive()
+
+    def check_route(self, result):
+        if self.calculating():
+            self.canvas.after(50, self.check_route, result)
+        elif "error" in result:
+            self.message_label.config(text=f"Couldn't generate the route: {result['error']}", bg="#ffd9d9")
+        else:
+            self.draw_route(result["routes"])
 
-        self.double_edges = choose_double_edges(self.edges)
-        self.path, self.colours = euler_path(self.edges, self.double_edges)
-
-        if self.path is None:
-            self.message_label.config(text="Error: disjoint graph", bg="#fcdddc")
+    def draw_route(self, routes):
+        """Make the edges that need to be repeated get drawn in bold"""
+        self.routes = routes
+        self.path = [edge for route in self.routes for edge in route["path"]]
+        self.colours = [colour for route in self.routes for colour in route["colours"]]
 
-        colour_map = plt.get_cmap('tab20').colors * 10
-        rainbow = colour_map[6:8] + colour_map[2:6] + colour_map[0:2] + colour_map[8:]
-        colour_ints = [[int(c*255) for c in colour] for colour in rainbow]
-        colour_hex = ["#" + ''.join('%02x'%i for i in colour) for colour in colour_ints]
+        colour_hex = route_palette()
 
         # Draw each edge with it's given colours
-        used_edges = set()
-        for i, edge in enumerate(self.path):
-            gradient = np.array(edge[1]) - np.array(edge[0])
-            unit_vector = gradient / np.linalg.norm(gradient)
-            rotation_matrix = [[0, 1], [-1, 0]]
-            if edge in used_edges:
-                rotation_matrix = [[0, -1], [1, 0]]
-            new_vector = np.dot(rotation_matrix, unit_vector)
-            dist = 3
-            x_change = dist * new_vector[0]
-            y_change = dist * new_vector[1]
-            line = self.canvas.create_line(edge[0][0] + x_change,
-                                    edge[0][1] + y_change, 
-                                    edge[1][0] + x_change, 
-                                    edge[1][1] + y_change, 
-                                    width=DOUBLE_EDGE_WIDTH, 
-                                    fill=colour_hex[self.colours[i]])
-            self.loop_drawings.append(line)
-            used_edges.add(edge)
+        self.clear_route()
+        if RASTER_ROUTE:
+            # The whole route becomes the background image, so the only canvas items left are the nodes and edges
+            route_image = route_overlay(self.background_image, (self.screen_width, self.screen_height), self.path,
+                                        self.colours, colour_hex, DOUBLE_EDGE_WIDTH)
+            self.route_image = ImageTk.PhotoImage(route_image)
+            self.canvas.itemconfig(self.canvas_background, image=self.route_image)
+        else:
+            for segment, colour in zip(offset_segments(self.path, ROUTE_OFFSET).tolist(), self.colours):
+                line = self.canvas.create_line(*segment, width=DOUBLE_EDGE_WIDTH, fill=colour_hex[colour])
+                self.loop_drawings.append(line)
+        used_edges = set(self.path)
 
         debug = False
         # # Draw numbers on the edges
@@ -348,9 +443,17 @@ class Radpath:
         self.message_label.config(text=f'distance = map width x {self.distance}', bg="#d9ffe0")
         
         # Save the edges to file
-        with open(EDGES_FILENAME, 'w') as file:
-            json.dump(self.edges, file)
-        self.preload_edges()
+        save_edge_store(EDGE_STORE_FILENAME, list(self.edges.values()))
+        if not RASTER_ROUTE:
+            # Redraw the nodes and edges so they sit on top of the route's lines
+            self.preload_edges()
+
+def route_palette():
+    """The colour of each loop of the route, as hex strings"""
+    colour_map = plt.get_cmap('tab20').colors * 10
+    rainbow = colour_map[6:8] + colour_map[2:6] + colour_map[0:2] + colour_map[8:]
+    colour_ints = [[int(c*255) for c in colour] for colour in rainbow]
+    return ["#" + ''.join('%02x'%i for i in colour) for colour in colour_ints]
 
 def total_length(edges, window_width):
     """Calculate the total length of the route"""
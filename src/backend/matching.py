@@ -0,0 +1,93 @@
+# Alternatives to nx.max_weight_matching for pairing up the odd nodes.
+# The approximate ones work on a candidate graph: a dictionary of {node: {other_node: distance}} that only needs to
+# hold nearby pairs.
+
+# Trying every way of pairing up the nodes takes about as long as networkx at this many nodes, and grows quickly after
+SMALL_MATCHING_MAX_NODES = 12
+
+def add_candidate(candidates, node1, node2, distance):
+    """Record the distance between two nodes in both directions"""
+    candidates.setdefault(node1, {})[node2] = distance
+    candidates.setdefault(node2, {})[node1] = distance
+
+def small_exact_matching(nodes, distances):
+    """The pairs with the shortest total distance, found by trying every way of pairing up the nodes (remembering the
+        best pairing of each subset along the way). The distances are keyed on (earlier node, later node) in nodes,
+        as get_shortest_paths_distances gives them. For a handful of nodes this is quicker than networkx,
+        and saves importing networkx at all, which is most of a Lambda cold start."""
+    best = {0: (0, None)}
+
+    def solve(remaining):
+        """The shortest pairing of the nodes in the remaining bitmask, and its first pair"""
+        if remaining not in best:
+            # The lowest remaining node has to be paired with something
+            first = (remaining & -remaining).bit_length() - 1
+            rest = remaining & ~(1 << first)
+            options = []
+            for other in range(first + 1, len(nodes)):
+                if rest & (1 << other):
+                    distance = distances[(nodes[first], nodes[other])] + solve(rest & ~(1 << other))[0]
+                    options.append((distance, other))
+            distance, other = min(options)
+            best[remaining] = (distance, (first, other))
+        return best[remaining]
+
+    pairs = set()
+    remaining = (1 << len(nodes)) - 1
+    while remaining:
+        first, other = solve(remaining)[1]
+        pairs.add((nodes[first], nodes[other]))
+        remaining &= ~((1 << first) | (1 << other))
+    return pairs
+
+def greedy_matching(candidates):
+    """Repeatedly pair up the two closest unmatched nodes. Nodes whose candidates all get taken are left unmatched."""
+    pairs = sorted((distance, node1, node2) for node1, others in candidates.items()
+                   for node2, distance in others.items() if node1 < node2)
+    partners = {}
+    for _, node1, node2 in pairs:
+        if node1 not in partners and node2 not in partners:
+            partners[node1] = node2
+            partners[node2] = node1
+    return partners
+
+def improve_matching(partners, candidates, max_passes=10):
+    """2-opt: swap the partners of two matched pairs whenever that shortens the total distance"""
+    for _ in range(max_passes):
+        improved = False
+        for node1 in list(partners):
+            partner1 = partners[node1]
+            for node2, distance12 in candidates[node1].items():
+                partner2 = partners.get(node2)
+                if node2 == partner1 or partner2 is None:
+                    continue
+                # Swap (node1, partner1) & (node2, partner2) for (node1, node2) & (partner1, partner2)
+                distance_partners = candidates[partner1].get(partner2)
+                if distance_partners is None:
+                    continue
+                old_distance = candidates[node1][partner1] + candidates[node2][partner2]
+                if distance12 + distance_partners < old_distance - 1e-9:
+                    partners[node1], partners[node2] = node2, node1
+                    partners[partner1], partners[partner2] = partner2, partner1
+                    improved = True
+                    break
+        if not improved:
+            break
+    return partners
+
+def candidate_pairs(candidates):
+    """Convert the candidate graph into a dictionary keyed on node pairs (tuples), once per pair"""
+    return {(node1, node2): distance for node1, others in candidates.items()
+            for node2, distance in others.items() if node1 < node2}
+
+def matching_partners(pairs):
+    """Convert a set of pairs into a dictionary of each node's partner"""
+    partners = {}
+    for node1, node2 in pairs:
+        partners[node1] = node2
+        partners[node2] = node1
+    return partners
+
+def matching_pairs(partners):
+    """Convert a dictionary of partners into a set of pairs, like nx.max_weight_matching returns"""
+    return {(node1, node2) for node1, node2 in partners.items() if node1 < node2}
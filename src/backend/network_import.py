@@ -0,0 +1,203 @@
+# Imports street networks from GeoJSON or CSV files into a list of edges for the routing pipeline, reading the file a
+# chunk at a time so even files of hundreds of MB only need memory for the nodes and edges, not the whole file.
+#   python network_import.py streets.geojson edges.bin --tolerance 0.00001
+#   python network_import.py segments.csv edges.json
+
+import argparse
+import csv
+import json
+import os
+
+from compact_graph import edge_key
+from edge_store import save_edge_store
+from spatial_index import GridIndex
+
+CHUNK_SIZE = 1024 * 1024
+FEATURE_PEEK = 1024 * 1024    # More text than any one feature of a sequence of features should need
+# GeoJSON text sequences (RFC 8142) start each feature with a record separator
+WHITESPACE = ' \t\r\n\x1e'
+
+class NodeSnapper:
+    """Interns coordinates as nodes, so the same point always comes back as the same tuple. Points closer than the
+        tolerance to an existing node are snapped onto it (e.g. where two streets were digitised a tiny bit apart),
+        using a grid with cells the size of the tolerance so each lookup only checks the cells around the point."""
+
+    def __init__(self, tolerance=0):
+        self.tolerance = tolerance
+        self.nodes = {}
+        self.index = GridIndex(tolerance) if tolerance > 0 else None
+
+    def snap(self, point):
+        point = (point[0], point[1])
+        node = self.nodes.get(point)
+        if node is not None:
+            return node
+        if self.index is not None:
+            node = self.index.within(point, self.tolerance)
+            if node is not None:
+                self.nodes[point] = node
+                return node
+            self.index.insert(point)
+        self.nodes[point] = point
+        return point
+
+class EdgeCollector:
+    """Builds the edge list from lines of points, snapping their points to nodes and leaving out repeated edges and
+        edges that snapped down to a single node"""
+
+    def __init__(self, tolerance=0):
+        self.snapper = NodeSnapper(tolerance)
+        self.edge_keys = set()
+        self.edges = []
+
+    def add_line(self, points):
+        nodes = [self.snapper.snap(point) for point in points]
+        for node1, node2 in zip(nodes[:-1], nodes[1:]):
+            key = edge_key((node1, node2))
+            if node1 != node2 and key not in self.edge_keys:
+                self.edge_keys.add(key)
+                self.edges.append((node1, node2))
+
+def geojson_features(file, chunk_size=CHUNK_SIZE):
+    """Generate the features of a GeoJSON FeatureCollection (or a sequence of features, one after another) one at a
+        time, only holding the text of the feature being decoded rather than the whole file"""
+    decoder = json.JSONDecoder()
+    text = file.read(chunk_size)
+    position = skip(text, 0)
+    first, end = try_decode(decoder, text, position)
+    # A sequence's first feature is short, but a collection can't be decoded until the end of the file, so it's a
+    # collection if the first value is still going after FEATURE_PEEK (only trying again each time the text doubles)
+    while first is None and len(text) < FEATURE_PEEK:
+        length = len(text)
+        while len(text) < 2 * length:
+            more = file.read(chunk_size)
+            if more == '':
+                break
+            text += more
+        if len(text) == length:
+            break
+        first, end = try_decode(decoder, text, position)
+    if first is None or first.get("type") != "Feature":
+        text, position = find_features_array(file, text, chunk_size), 0
+        separator = ','
+    else:
+        separator = ''
+
+    while True:
+        position = skip(text, position, separator)
+        if position < len(text) and text[position] == ']':
+            return
+        feature, end = try_decode(decoder, text, position)
+        if feature is None:
+            more = file.read(chunk_size)
+            if more == '':
+                if text[position:].strip(WHITESPACE) == '':
+                    return
+                raise ValueError("The GeoJSON ends part way through a feature")
+            # Drop what's been decoded already, so the text only ever holds about one feature and one chunk
+            text, position = text[position:] + more, 0
+            continue
+        yield feature
+        position = end
+
+def find_features_array(file, text, chunk_size):
+    """Read ahead to the FeatureCollection's "features": [, returning the text after the bracket"""
+    key = '"features"'
+    search_from = 0
+    while True:
+        start = text.find(key, search_from)
+        if start >= 0:
+            colon = skip(text, start + len(key))
+            bracket = skip(text, colon + 1)
+            if bracket < len(text):
+                if text[colon] == ':' and text[bracket] == '[':
+                    return text[bracket + 1:]
+                # Just the word features somewhere else, e.g. in a name
+                search_from = start + 1
+                continue
+            # The key is right at the end of what's been read, so keep it and read some more
+            text, search_from = text[start:], 0
+        else:
+            # Keep the end of the text, in case the key was split between the chunks
+            text, search_from = text[-len(key):], 0
+        more = file.read(chunk_size)
+        if more == '':
+            raise ValueError("There's no features array in the GeoJSON")
+        text += more
+
+def skip(text, position, characters=''):
+    while position < len(text) and (text[position] in WHITESPACE or text[position] in characters):
+        position += 1
+    return position
+
+def try_decode(decoder, text, position):
+    """Decode the JSON value starting at this position, or return None if the text stops part way through it"""
+    try:
+        return decoder.raw_decode(text, position)
+    except json.JSONDecodeError:
+        return None, position
+
+def feature_lines(feature):
+    """The lines of points in a LineString or MultiLineString feature (other geometries aren't streets, so have none).
+        Any heights are dropped."""
+    geometry = feature.get("geometry") or {}
+    if geometry.get("type") == "LineString":
+        lines = [geometry["coordinates"]]
+    elif geometry.get("type") == "MultiLineString":
+        lines = geometry["coordinates"]
+    else:
+        return []
+    return [[(point[0], point[1]) for point in line] for line in lines]
+
+def csv_segments(file):
+    """Generate the segments of a CSV file with a row per segment, as pairs of points. The columns are found by a
+        header row naming x1, y1, x2 and y2, or if there's no header, they're the first four columns."""
+    columns = [0, 1, 2, 3]
+    for row_number, row in enumerate(csv.reader(file)):
+        if len(row) == 0:
+            continue
+        if row_number == 0 and not is_number(row[0]):
+            header = [name.strip().lower() for name in row]
+            columns = [header.index(name) for name in ('x1', 'y1', 'x2', 'y2')]
+            continue
+        x1, y1, x2, y2 = (float(row[column]) for column in columns)
+        yield (x1, y1), (x2, y2)
+
+def is_number(text):
+    try:
+        float(text)
+        return True
+    except ValueError:
+        return False
+
+def import_network(filename, tolerance=0):
+    """Read the edges from a GeoJSON (.geojson, .json, .geojsonl, .geojsons) or CSV (.csv) file, as a list of
+        (node1, node2) pairs of coordinate tuples like choose_double_edges and euler_path take"""
+    collector = EdgeCollector(tolerance)
+    with open(filename, 'r', newline='') as file:
+        if os.path.splitext(filename)[1].lower() == '.csv':
+            for segment in csv_segments(file):
+                collector.add_line(segment)
+        else:
+            for feature in geojson_features(file):
+                for line in feature_lines(feature):
+                    collector.add_line(line)
+    return collector.edges
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Import a GeoJSON or CSV street network as edges")
+    parser.add_argument("input", help="a .geojson file of LineStrings, or a .csv file with x1, y1, x2, y2 columns")
+    parser.add_argument("output", help="where to save the edges, as .bin (the binary edge store) or .json")
+    parser.add_argument("--tolerance", type=float, default=0, help="snap points closer than this onto one node")
+    arguments = parser.parse_args(arguments)
+
+    edges = import_network(arguments.input, arguments.tolerance)
+    if arguments.output.endswith('.json'):
+        with open(arguments.output, 'w') as file:
+            json.dump(edges, file)
+    else:
+        save_edge_store(arguments.output, edges)
+    print(f"Imported {len(edges)} edges into {arguments.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import base64
+import numpy as np
+
+from compact_graph import coordinate_dtype
+
+# full: every edge of the path as a pair of coordinates, with a parallel list of colours (what the React app reads)
+# compact: a table of the nodes, then each route as the differences between consecutive node indices,
+#          with the colours run length encoded, and where the route jumps between edges that don't meet
+# compact_binary: compact, but with the arrays packed as little endian numbers and base64 encoded
+PAYLOAD_FORMATS = ('full', 'compact', 'compact_binary')
+
+def compact_payload(routes, binary=False):
+    """Encode the routes with each node's coordinates sent once, and the route as a sequence of node indices.
+        Consecutive edges of a route usually share a node, so each route is just its first node and then the next
+        node of every edge. Where an edge doesn't start at the end of the one before it (the route can jump when
+        some nodes have odd degree), its first node goes in the sequence too, and its position is listed in breaks.
+        The indices are delta encoded (nodes are numbered in the order the routes first reach them, so the
+        differences stay small), and each route's colours become [colour, count] runs."""
+    node_ids = {}
+    encoded_routes = []
+    for route in routes:
+        path = route["path"]
+        if len(path) == 0:
+            encoded_routes.append({"steps": [], "breaks": [], "colour_runs": []})
+            continue
+        sequence = [node_ids.setdefault(tuple(path[0][0]), len(node_ids))]
+        breaks = []
+        for edge in path:
+            node1 = node_ids.setdefault(tuple(edge[0]), len(node_ids))
+            if node1 != sequence[-1]:
+                breaks.append(len(sequence))
+                sequence.append(node1)
+            sequence.append(node_ids.setdefault(tuple(edge[1]), len(node_ids)))
+        steps = np.diff(sequence, prepend=0)
+        encoded_routes.append({"steps": steps, "breaks": breaks, "colour_runs": colour_runs(route["colours"])})
+
+    nodes = np.array(list(node_ids), dtype=float).reshape(-1, 2)
+    node_dtype = coordinate_dtype(nodes)
+    if binary:
+        return {
+            "format": "compact_binary",
+            "node_dtype": node_dtype,
+            "nodes": pack(nodes, node_dtype),
+            "routes": [{"steps": pack(route["steps"], np.int32), "breaks": pack(route["breaks"], np.int32),
+                        "colour_runs": pack(route["colour_runs"], np.int32)}
+                       for route in encoded_routes],
+        }
+    return {
+        "format": "compact",
+        "nodes": nodes.astype(int).tolist() if node_dtype == 'int32' else nodes.tolist(),
+        "routes": [{"steps": np.asarray(route["steps"], dtype=int).tolist(), "breaks": route["breaks"],
+                    "colour_runs": route["colour_runs"]}
+                   for route in encoded_routes],
+    }
+
+def colour_runs(colours):
+    """Run length encode the colours as [colour, count] pairs"""
+    runs = []
+    for colour in colours:
+        if len(runs) > 0 and runs[-1][0] == colour:
+            runs[-1][1] += 1
+        else:
+            runs.append([colour, 1])
+    return runs
+
+def pack(values, dtype):
+    """Pack an array of numbers into base64 text"""
+    return base64.b64encode(np.asarray(values, dtype=np.dtype(dtype).newbyteorder('<')).tobytes()).decode('ascii')
+
+def unpack(text, dtype):
+    return np.frombuffer(base64.b64decode(text), dtype=np.dtype(dtype).newbyteorder('<'))
+
+def expand_payload(payload):
+    """Decode a compact payload back into the routes (each with its path and colours)"""
+    binary = payload["format"] == "compact_binary"
+    if binary:
+        nodes = unpack(payload["nodes"], payload["node_dtype"]).reshape(-1, 2).tolist()
+    else:
+        nodes = payload["nodes"]
+    nodes = [tuple(node) for node in nodes]
+    routes = []
+    for route in payload["routes"]:
+        steps = unpack(route["steps"], np.int32) if binary else route["steps"]
+        runs = unpack(route["colour_runs"], np.int32).reshape(-1, 2) if binary else route["colour_runs"]
+        breaks = set(unpack(route["breaks"], np.int32).tolist() if binary else route["breaks"])
+        sequence = np.cumsum(steps, dtype=np.int64).tolist()
+        # There's no edge into the node at each break, since the route jumps there
+        path = [(nodes[sequence[position - 1]], nodes[sequence[position]]) for position in range(1, len(sequence))
+                if position not in breaks]
+        colours = [int(colour) for colour, count in runs for _ in range(count)]
+        routes.append({"path": path, "colours": colours})
+    return routes
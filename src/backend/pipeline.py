@@ -0,0 +1,137 @@
+# Shared routing pipeline for lambda_function.py, server.py and main.py
+
+from itertools import repeat
+import json
+import time
+
+from double_edges import choose_double_edges
+from euler_path import euler_path, route_segments
+from instrumentation import attach_report, count, instrumented, log_report, stage
+from payload import PAYLOAD_FORMATS, compact_payload
+from route_cache import edge_set_key
+
+# Starting worker processes costs more than it saves on small networks
+PARALLEL_MIN_EDGES = 2000
+
+class UnknownFormat(ValueError):
+    """The request asked for a payload format that isn't one of PAYLOAD_FORMATS"""
+
+def solve_route(edges, matching='exact'):
+    """Choose the double edges and then the route for a single connected network"""
+    double_edges = choose_double_edges(edges, matching)
+    with stage('euler_path'):
+        path, colours = euler_path(edges, double_edges)
+    return {"path": path, "colours": colours}
+
+def solve_components(edges, matching='exact', processes=None):
+    """Solve each connected component of the network separately, returning one route per component.
+        The components are solved in a process pool when there are several of them and the network is large."""
+    with stage('split_components'):
+        components = split_components(edges)
+    count('components', len(components))
+    if len(components) <= 1 or len(edges) < PARALLEL_MIN_EDGES or processes == 1:
+        return [solve_route(component, matching) for component in components]
+    # The worker processes don't report their stages, so this covers all of them
+    with stage('component_pool'):
+        return _map_in_processes(solve_route, components, matching, processes)
+
+def _map_in_processes(function, items, matching, processes):
+    """function(item, matching) for each item, spread across a process pool"""
+    try:
+        # Imported here since multiprocessing is slow to import, and AWS Lambda can't use it anyway
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            return list(pool.map(function, items, repeat(matching)))
+    except (OSError, NotImplementedError):
+        # Some environments (e.g. AWS Lambda) don't support multiprocessing, so just do them one at a time
+        return [function(item, matching) for item in items]
+
+def split_components(edges):
+    """Group the edges by connected component, with a union find over the nodes.
+        Components are ordered by where their first edge appears."""
+    parents = {}
+
+    def find(node):
+        root = parents.setdefault(node, node)
+        while root != parents[root]:
+            root = parents[root]
+        # Point everything along the way straight at the root, so later finds are quick
+        while node != root:
+            parents[node], node = root, parents[node]
+        return root
+
+    for edge in edges:
+        root1, root2 = find(edge[0]), find(edge[1])
+        if root1 != root2:
+            parents[root2] = root1
+
+    components = {}
+    for edge in edges:
+        components.setdefault(find(edge[0]), []).append(edge)
+    return list(components.values())
+
+def combine_routes(routes):
+    """The response body: every route, plus one path and colours list across all of them for single route clients"""
+    return {
+        "path": [edge for route in routes for edge in route["path"]],
+        "colours": [colour for route in routes for colour in route["colours"]],
+        "routes": routes,
+    }
+
+def solve_to_json(edges, matching='exact', payload_format='full'):
+    """Solve every component and encode the response body, in one of the PAYLOAD_FORMATS"""
+    if payload_format not in PAYLOAD_FORMATS:
+        raise UnknownFormat(f"Unknown format {payload_format!r}, expected one of {PAYLOAD_FORMATS}")
+    routes = solve_components(edges, matching)
+    if payload_format == 'full':
+        return json.dumps(combine_routes(routes))
+    return json.dumps(compact_payload(routes, binary=payload_format == 'compact_binary'), separators=(',', ':'))
+
+def solve_request(edges, body, cache, **log_fields):
+    """Answer a route request for server.py and lambda_function.py, returning the route JSON and whether it came
+        from the cache. Large maps can ask for a compact "format" (an unknown one raises UnknownFormat).
+        Every request logs its stage timings, along with any log_fields. Asking to "instrument" also samples the peak
+        memory and adds the report to the response (skipping the cache, so the stages actually run), and "profile"
+        adds a cProfile summary too."""
+    payload_format = body.get("format", "full")
+    show_report = body.get("instrument", False) or body.get("profile", False)
+    with instrumented(memory=body.get("instrument", False), profile=body.get("profile", False)) as instrumentation:
+        # Each separate part of the network gets its own route
+        key = edge_set_key(edges) if payload_format == 'full' else edge_set_key(edges, format=payload_format)
+        if show_report:
+            route_json, cache_hit = solve_to_json(edges, payload_format=payload_format), False
+        else:
+            route_json, cache_hit = cache.get_or_compute(key, lambda: solve_to_json(edges, payload_format=payload_format))
+    log_report("route", instrumentation, cache="hit" if cache_hit else "miss", format=payload_format,
+               cache_stats=cache.stats(), **log_fields)
+    if show_report:
+        route_json = attach_report(route_json, instrumentation)
+    return route_json, cache_hit
+
+def solve_to_ndjson(edges, matching='exact'):
+    """Solve each component in turn, generating one line of JSON per edge as soon as its place in the route is settled.
+        Each line has the edge, its colour and which route (i.e. component) it belongs to."""
+    for route_number, component in enumerate(split_components(edges)):
+        double_edges = choose_double_edges(component, matching)
+        for edge, colour in route_segments(component, double_edges):
+            yield json.dumps({"route": route_number, "edge": edge, "colour": colour}, separators=(',', ':')) + "\n"
+
+def solve_batch(edge_sets, matching='exact', processes=None):
+    """Solve several networks at once, one per worker process, returning their results in the same order.
+        Each result has the route (or the error that stopped it) and how long it took, so one bad network
+        doesn't lose the rest of the batch."""
+    if len(edge_sets) <= 1 or processes == 1:
+        return [solve_batch_item(edges, matching) for edges in edge_sets]
+    return _map_in_processes(solve_batch_item, edge_sets, matching, processes)
+
+def solve_batch_item(edges, matching='exact'):
+    """Solve one network of a batch, catching any error instead of raising it"""
+    start = time.perf_counter()
+    try:
+        edge_tuples = [[tuple(node) for node in edge] for edge in edges]
+        # The batch is already spread across the processes, so the components are solved in this one
+        result = {"route": combine_routes(solve_components(edge_tuples, matching, processes=1)), "error": None}
+    except Exception as error:
+        result = {"route": None, "error": f"{type(error).__name__}: {error}"}
+    result["seconds"] = time.perf_counter() - start
+    return result
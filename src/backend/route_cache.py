@@ -0,0 +1,149 @@
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import threading
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_DISK_BYTES = 512 * 1024 * 1024
+
+def edge_set_key(edges, **options):
+    """A canonical hash of the edges, which doesn't depend on the order of the edges or the direction of each edge.
+        Any options that change the result (e.g. the matching strategy) are part of the key too."""
+    canonical_edges = sorted(sorted([list(edge[0]), list(edge[1])]) for edge in edges)
+    canonical = json.dumps([canonical_edges, sorted(options.items())], separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+class RouteCache:
+    """An in-memory LRU cache of JSON route results keyed on edge_set_key, evicting the least recently used results
+        once their total size goes over max_bytes. If a folder is given, results are also written there as files,
+        so they survive restarts and can be shared between processes. The files are capped too: once they add up to
+        more than max_disk_bytes, the least recently used files are deleted.
+        It's safe to use from several threads (e.g. Flask's request threads and the job queue's callbacks)."""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, folder=None, max_disk_bytes=DEFAULT_MAX_DISK_BYTES):
+        self.max_bytes = max_bytes
+        self.folder = folder
+        self.max_disk_bytes = max_disk_bytes
+        self.disk_size = None   # Only counted the first time a file is written
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the cached JSON text for this key, or None"""
+        with self.lock:
+            text = self.entries.get(key)
+            if text is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return text
+            text = self.read_file(key)
+            if text is not None:
+                self.disk_hits += 1
+                self.remember(key, text)
+                return text
+            self.misses += 1
+            return None
+
+    def put(self, key, text):
+        with self.lock:
+            self.remember(key, text)
+            self.write_file(key, text)
+
+    def get_or_compute(self, key, compute):
+        """Return the cached JSON text, or compute it, cache it and return it. Also returns whether it was a hit."""
+        text = self.get(key)
+        if text is not None:
+            return text, True
+        text = compute()
+        self.put(key, text)
+        return text, False
+
+    def remember(self, key, text):
+        """Add to the in-memory tier, evicting the least recently used results to stay under max_bytes.
+            Only called with the lock held."""
+        size = len(text)
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self.size -= len(self.entries.pop(key))
+        self.entries[key] = text
+        self.size += size
+        while self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    def file_path(self, key):
+        return os.path.join(self.folder, f"{key}.json")
+
+    def read_file(self, key):
+        if self.folder is None:
+            return None
+        try:
+            with open(self.file_path(key), 'r') as file:
+                text = file.read()
+            # Touch the file, so the disk tier evicts the least recently used files rather than the oldest
+            os.utime(self.file_path(key))
+            return text
+        except FileNotFoundError:
+            return None
+
+    def write_file(self, key, text):
+        if self.folder is None:
+            return
+        os.makedirs(self.folder, exist_ok=True)
+        # Write to a temporary file first, so another process never reads half a result
+        temporary_path = f"{self.file_path(key)}.{os.getpid()}.tmp"
+        with open(temporary_path, 'w') as file:
+            file.write(text)
+        os.replace(temporary_path, self.file_path(key))
+        if self.disk_size is None:
+            self.disk_size = sum(size for _, size, _ in self.cache_files())
+        else:
+            self.disk_size += len(text)
+        if self.disk_size > self.max_disk_bytes:
+            self.evict_files()
+
+    def cache_files(self):
+        """(path, size, last used time) of each cached file"""
+        files = []
+        for entry in os.scandir(self.folder):
+            if entry.name.endswith('.json'):
+                try:
+                    stat = entry.stat()
+                    files.append((entry.path, stat.st_size, stat.st_mtime))
+                except FileNotFoundError:
+                    # Another process evicted it while we were looking
+                    pass
+        return files
+
+    def evict_files(self):
+        """Delete the least recently used files until the folder is back under three quarters of max_disk_bytes,
+            so this doesn't have to happen again on the very next write. Other processes sharing the folder also
+            write to it, so the folder is measured again rather than trusting disk_size."""
+        files = sorted(self.cache_files(), key=lambda file: file[2])
+        self.disk_size = sum(size for _, size, _ in files)
+        for path, size, _ in files:
+            if self.disk_size <= self.max_disk_bytes * 3 // 4:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Another process evicted it first
+                pass
+            self.disk_size -= size
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+            }
@@ -0,0 +1,60 @@
+import struct
+import zlib
+import numpy as np
+
+from route_image import draw_route, offset_segments
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+STRIP_HEIGHT = 1024     # Rows of the image drawn and written at a time
+
+def export_route(basemap, output_filename, path, colours, palette, width, screen_width,
+                 strip_height=STRIP_HEIGHT):
+    """Draw the route onto the full resolution basemap (a BasemapPyramid) and save it as a PNG.
+        The route was drawn on the basemap after it was shrunk to fit the screen (screen_width pixels across),
+        so its coordinates are scaled back up to the basemap's size. The image is read, drawn and written a strip of
+        rows at a time, so only one strip is ever in memory, rather than several copies of the whole image."""
+    scale = basemap.width / screen_width
+    segments = offset_segments(path) * scale
+    colours = np.asarray(colours, dtype=int)
+    # How far a line can reach beyond its ends, so lines just outside a strip still get their edges drawn
+    margin = width * scale
+    tops = np.minimum(segments[:, 1], segments[:, 3]) - margin
+    bottoms = np.maximum(segments[:, 1], segments[:, 3]) + margin
+
+    def strips():
+        for top in range(0, basemap.height, strip_height):
+            bottom = min(top + strip_height, basemap.height)
+            inside = (bottoms >= top) & (tops <= bottom)
+            strip = basemap.rows(top, bottom)
+            # Draw in the strip's own coordinates, keeping the lines in the same order so overlaps look the same
+            shifted = segments[inside] - [0, top, 0, top]
+            yield draw_route(strip, shifted, colours[inside].tolist(), palette, width * scale)
+
+    with open(output_filename, 'wb') as file:
+        write_png(file, basemap.size, strips())
+
+def write_png(file, size, strips):
+    """Write RGB image strips (top to bottom, each the full width) as a single PNG, compressing each strip as it
+        arrives instead of holding the whole image"""
+    width, height = size
+    file.write(PNG_SIGNATURE)
+    write_chunk(file, b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+    compressor = zlib.compressobj(6)
+    rows_written = 0
+    for strip in strips:
+        pixels = np.asarray(strip.convert('RGB'), dtype=np.uint8).reshape(strip.height, width * 3)
+        # Each row starts with its filter type, which is 0 (none)
+        rows = np.concatenate((np.zeros((strip.height, 1), dtype=np.uint8), pixels), axis=1)
+        data = compressor.compress(rows.tobytes())
+        if len(data) > 0:
+            write_chunk(file, b'IDAT', data)
+        rows_written += strip.height
+    if rows_written != height:
+        raise ValueError(f"The strips had {rows_written} rows, but the image has {height}")
+    write_chunk(file, b'IDAT', compressor.flush())
+    write_chunk(file, b'IEND', b'')
+
+def write_chunk(file, chunk_type, data):
+    file.write(struct.pack('>I', len(data)))
+    file.write(chunk_type + data)
+    file.write(struct.pack('>I', zlib.crc32(chunk_type + data)))
@@ -0,0 +1,48 @@
+from PIL import Image, ImageDraw
+import numpy as np
+
+ROUTE_OFFSET = 3    # How far each line of the route sits to the side of its edge, so doubled edges show up as two lines
+
+def offset_segments(path, distance=ROUTE_OFFSET):
+    """Shift every edge of the path sideways by the distance, all at once. Travelling an edge the other way puts it
+        on the other side anyway, so only the second time it's travelled in the same direction gets flipped over.
+        Returns an (n, 4) array of x1, y1, x2, y2 for each edge."""
+    if len(path) == 0:
+        return np.zeros((0, 4))
+    ends = np.asarray(path, dtype=float).reshape(-1, 4)
+    gradients = ends[:, 2:] - ends[:, :2]
+    lengths = np.linalg.norm(gradients, axis=1, keepdims=True)
+    unit_vectors = np.divide(gradients, lengths, out=np.zeros_like(gradients), where=lengths > 0)
+    # Rotating a quarter turn clockwise (in screen coordinates, where y points down)
+    normals = np.column_stack((unit_vectors[:, 1], -unit_vectors[:, 0]))
+
+    _, first, inverse = np.unique(ends, axis=0, return_index=True, return_inverse=True)
+    repeated = first[inverse.ravel()] != np.arange(len(ends))
+    normals[repeated] *= -1
+    return ends + distance * np.tile(normals, 2)
+
+def draw_route(image, segments, colours, palette, width, scale=1):
+    """Draw the offset segments onto a copy of the image, each in its palette colour. Coordinates are multiplied
+        by the scale first, for drawing onto an image bigger than the screen the route was drawn on."""
+    image = flatten(image)
+    draw = ImageDraw.Draw(image)
+    line_width = max(int(round(width * scale)), 1)
+    for segment, colour in zip((segments * scale).tolist(), colours):
+        draw.line(segment, fill=palette[colour], width=line_width)
+    return image
+
+def route_overlay(background, size, path, colours, palette, width):
+    """The background (at the top left, like on the canvas) with the route drawn over it, as one image the size of
+        the canvas. Tk slows to a crawl with tens of thousands of canvas items, but a single image costs the same
+        however long the route is."""
+    image = Image.new('RGB', size, 'white')
+    image.paste(background, (0, 0), background if background.mode == 'RGBA' else None)
+    return draw_route(image, offset_segments(path), colours, palette, width)
+
+def flatten(image, colour='white'):
+    """The image in RGB, with any transparent parts shown over the colour"""
+    if image.mode != 'RGBA':
+        return image.convert('RGB')
+    flat = Image.new('RGB', image.size, colour)
+    flat.paste(image, (0, 0), image)
+    return flat
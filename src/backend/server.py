@@ -1,27 +1,85 @@
-from flask import Flask, request
-from double_edges import choose_double_edges
-from euler_path import euler_path
+import json
+import logging
+
+from flask import Flask, Response, request
+from jobs import JobQueue, QueueFull
+from path_variables import data_folder
+from pipeline import UnknownFormat, solve_batch, solve_request, solve_to_ndjson
+from route_cache import RouteCache
 
 app = Flask(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# Results are kept in memory and also written under the data folder, so they survive restarting the server
+route_cache = RouteCache(folder=data_folder / 'route_cache')
+
+# How many processes /batch spreads the networks across (None uses one per core)
+BATCH_PROCESSES = None
+
+# Jobs submitted to /jobs run in the background, and new jobs get turned away once this many are waiting
+JOB_PROCESSES = None
+JOB_QUEUE_DEPTH = 16
+job_queue = JobQueue(route_cache, processes=JOB_PROCESSES, max_pending=JOB_QUEUE_DEPTH)
  
 @app.route("/data", methods=["POST"])
 def get_time():
-    print("Route /data called")
     data = request.json
     edges = data.get("edges")
     edge_tuples = [[tuple(node) for node in edge] for edge in edges]
-    print("edge_tuples", edge_tuples)
-
-    double_edges = choose_double_edges(edge_tuples)
-    print("double_edges", double_edges)
-    
-    path, colours = euler_path(edge_tuples, double_edges)
-    results = {
-        "path":path, 
-        "colours":colours,
-    }
-    print("results: ", results)
-    return results
+
+    # Clients that ask for NDJSON get each edge as soon as it's settled, instead of waiting for the whole route
+    if "application/x-ndjson" in request.headers.get("Accept", ""):
+        return Response(solve_to_ndjson(edge_tuples), mimetype="application/x-ndjson")
+
+    # Large maps can ask for the compact payload, which sends each node once instead of twice per edge
+    try:
+        route_json, cache_hit = solve_request(edge_tuples, data, route_cache)
+    except UnknownFormat as error:
+        return {"error": str(error)}, 400
+    return Response(route_json, mimetype="application/json", headers={"X-Radpath-Cache": "hit" if cache_hit else "miss"})
+
+@app.route("/batch", methods=["POST"])
+def batch():
+    """Route a list of networks, returning a result for each one in the same order"""
+    data = request.json
+    edge_sets = data.get("edge_sets", [])
+    results = solve_batch(edge_sets, processes=BATCH_PROCESSES)
+    return Response(json.dumps({"results": results}), mimetype="application/json")
+
+@app.route("/jobs", methods=["POST"])
+def submit_job():
+    """Start routing the network in the background, returning a job id to poll for the result"""
+    data = request.json
+    edges = data.get("edges")
+    edge_tuples = [[tuple(node) for node in edge] for edge in edges]
+    try:
+        job_id = job_queue.submit(edge_tuples)
+    except QueueFull as error:
+        return {"error": str(error)}, 429, {"Retry-After": "5"}
+    return {"job_id": job_id, **job_queue.status(job_id)}, 202
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    status = job_queue.status(job_id)
+    if status is None:
+        return {"error": "Unknown job"}, 404
+    return {"job_id": job_id, **status}
+
+@app.route("/jobs/<job_id>/result", methods=["GET"])
+def job_result(job_id):
+    route_json = job_queue.result(job_id)
+    if route_json is not None:
+        return Response(route_json, mimetype="application/json")
+    status = job_queue.status(job_id)
+    if status is None:
+        return {"error": "Unknown job"}, 404
+    if status["status"] == "failed":
+        return {"job_id": job_id, **status}, 500
+    return {"job_id": job_id, **status}, 202
+
+@app.route("/cache", methods=["GET"])
+def cache_stats():
+    return route_cache.stats()
  
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,88 @@
+from collections import defaultdict
+import heapq
+import math
+
+class GridIndex:
+    """A uniform grid over 2D points, for finding nearby nodes without comparing against every node"""
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = defaultdict(list)
+        self.min_cell = None
+        self.max_cell = None
+
+    @classmethod
+    def from_points(cls, points, items=None, points_per_cell=2):
+        """Choose a cell size that puts a few points in each cell, then insert every point.
+            Each point is stored with an item (e.g. a node id) that the queries return, defaulting to the point itself."""
+        points = list(points)
+        if len(points) == 0:
+            return cls(1)
+        xs = [point[0] for point in points]
+        ys = [point[1] for point in points]
+        area = max(max(xs) - min(xs), 1) * max(max(ys) - min(ys), 1)
+        index = cls(math.sqrt(area * points_per_cell / len(points)))
+        for point, item in zip(points, points if items is None else items):
+            index.insert(point, item)
+        return index
+
+    def cell(self, point):
+        return (int(point[0] // self.cell_size), int(point[1] // self.cell_size))
+
+    def insert(self, point, item=None):
+        cell = self.cell(point)
+        self.cells[cell].append((point, point if item is None else item))
+        if self.min_cell is None:
+            self.min_cell, self.max_cell = cell, cell
+        else:
+            self.min_cell = (min(self.min_cell[0], cell[0]), min(self.min_cell[1], cell[1]))
+            self.max_cell = (max(self.max_cell[0], cell[0]), max(self.max_cell[1], cell[1]))
+
+    def remove(self, point):
+        """Remove the point (the bounds of the grid stay as they were, which only makes nearest look a bit further)"""
+        cell = self.cell(point)
+        entries = self.cells.get(cell, [])
+        self.cells[cell] = [entry for entry in entries if entry[0] != point]
+        if len(self.cells[cell]) == 0:
+            del self.cells[cell]
+
+    def within(self, point, radius):
+        """The item of the closest point less than radius away from this point, or None.
+            Only the cells overlapping the circle are checked, so this doesn't depend on how many points there are."""
+        low = self.cell((point[0] - radius, point[1] - radius))
+        high = self.cell((point[0] + radius, point[1] + radius))
+        closest = None
+        for x in range(low[0], high[0] + 1):
+            for y in range(low[1], high[1] + 1):
+                for other, item in self.cells.get((x, y), ()):
+                    distance = math.dist(point, other)
+                    if distance < radius and (closest is None or distance < closest[0]):
+                        closest = (distance, item)
+        return None if closest is None else closest[1]
+
+    def nearest(self, point, k):
+        """The items of the k closest points to this point (excluding the point itself), nearest first"""
+        if self.min_cell is None:
+            return []
+        centre = self.cell(point)
+        max_ring = max(abs(centre[0] - self.min_cell[0]), abs(centre[0] - self.max_cell[0]),
+                       abs(centre[1] - self.min_cell[1]), abs(centre[1] - self.max_cell[1]))
+        found = []
+        for ring in range(max_ring + 1):
+            for cell in ring_cells(centre, ring):
+                for other, item in self.cells.get(cell, ()):
+                    if other != point:
+                        found.append((math.dist(point, other), item))
+            # Anything in the next ring is at least this far away, so we can stop once we have k closer points
+            if len(found) >= k and heapq.nsmallest(k, found)[-1][0] <= ring * self.cell_size:
+                break
+        return [item for _, item in heapq.nsmallest(k, found)]
+
+def ring_cells(centre, ring):
+    """The cells on the square ring at this distance from the centre cell"""
+    if ring == 0:
+        return [centre]
+    x, y = centre
+    cells = [(x + dx, y + dy) for dx in range(-ring, ring + 1) for dy in (-ring, ring)]
+    cells += [(x + dx, y + dy) for dx in (-ring, ring) for dy in range(-ring + 1, ring)]
+    return cells